@@ -0,0 +1,271 @@
+"""Crawler benchmarks. Each one prints a small table of its measurements
+    python benchmark.py startup --runs 5
+    python benchmark.py warm --lean
+    python benchmark.py crawl --sites picsearch --downloads 4 8 16
+"""
+
+#stdlib
+import argparse
+import math
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from threading import Event, Thread
+#module
+from fakesearch import FakeSearchServer
+from metrics import Metrics
+
+
+def process_tree_rss(pid: int) -> int:
+    '''Returns the summed resident set size in bytes of a process and its descendants (Linux)'''
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry)) as stat:
+                ppid = int(stat.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, []))
+        try:
+            with open('/proc/{}/status'.format(current)) as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+class PeakRSS:
+    """Samples the RSS of this process and its children (browsers included)
+    in the background and keeps the peak, in bytes
+    """
+
+    def __init__(self, interval: float=.1):
+        self.interval = interval
+        self.peak = 0
+        self._stop = Event()
+        self._thread = Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+    def __exit__(self, *_):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while True:
+            self.peak = max(self.peak, process_tree_rss(os.getpid()))
+            if self._stop.wait(self.interval):
+                return
+
+
+class SampledMetrics(Metrics):
+    """Metrics that also keep every observed value, for exact percentiles
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.samples = defaultdict(list)
+
+    def observe(self, name: str, value: float, **labels):
+        super().observe(name, value, **labels)
+        with self._lock:
+            self.samples[name].append(value)
+
+
+def percentile(values: list, q: float) -> float:
+    '''Nearest-rank percentile, 0 for no values'''
+    if not values:
+        return 0.
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def report(title: str, rows: list, columns: list):
+    '''Prints rows of dicts as an aligned table'''
+    print(title)
+    print('  '.join('{:>14}'.format(col) for col in columns))
+    for row in rows:
+        print('  '.join('{:>14}'.format(row[col] if isinstance(row[col], str)
+                                        else '{:.3f}'.format(row[col])) for col in columns))
+
+
+def bench_startup(args):
+    '''Driver start-up time and browser RSS, default launch mode against lean mode'''
+    from webpage import WebPage
+    rows = []
+    for mode in ('default', 'lean'):
+        seconds, rss = [], []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            page = WebPage(url=None, browser=args.browser, lean=mode == 'lean')
+            try:
+                page.driver.get(args.url)
+                seconds.append(time.perf_counter() - started)
+                rss.append(process_tree_rss(page.driver.service.process.pid) / 2**20)
+            finally:
+                page.close_page()
+        rows.append({'mode': mode, 'startup_s': statistics.median(seconds),
+                     'rss_mb': statistics.median(rss)})
+    report('{} start-up + first load of {} (median of {})'.format(args.browser, args.url, args.runs),
+           rows, ['mode', 'startup_s', 'rss_mb'])
+
+
+def bench_warm(args):
+    '''Time from nothing to a loaded page: a cold WebPage against a session leased
+    from a warm browser daemon, plus the cost of importing the crawler'''
+    import subprocess
+    import sys
+    from browserd import BrowserClient, BrowserDaemon
+    from webpage import WebPage
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import crawler'], check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    rows = [{'mode': 'import crawler', 'startup_s': time.perf_counter() - started}]
+    cold = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        page = WebPage(url=None, browser='chrome', lean=args.lean)
+        try:
+            page.driver.get(args.url)
+            cold.append(time.perf_counter() - started)
+        finally:
+            page.close_page()
+    rows.append({'mode': 'cold', 'startup_s': statistics.median(cold)})
+    factory = lambda: WebPage(url=None, browser='chrome', lean=args.lean)
+    with BrowserDaemon(size=1, factory=factory) as daemon:
+        client = BrowserClient(daemon.serve(port=0))
+        while not daemon.status()['idle']:
+            time.sleep(.1)
+        warm = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            page = WebPage(url=None, browser='chrome', remote=client.lease())
+            try:
+                page.driver.get(args.url)
+                warm.append(time.perf_counter() - started)
+            finally:
+                page.close_page()
+                client.release(page.remote['session_id'])
+        rows.append({'mode': 'warm', 'startup_s': statistics.median(warm)})
+    report('chrome{} start-up + first load of {} (median of {})'.format(
+               ' lean' if args.lean else '', args.url, args.runs), rows, ['mode', 'startup_s'])
+
+
+def bench_crawl(args):
+    '''Full crawls against a local fake search server, for each concurrency setting'''
+    from crawler import ImageCrawl
+    from jobsource import JobSource
+    rows = []
+    with FakeSearchServer(latency=args.latency, image_latency=args.image_latency,
+                          pages=args.pages, per_page=args.per_page) as server:
+        sites = {name: site for name, site in server.sites().items() if name in args.sites}
+        uses_browser = any(site.requires_js for site in sites.values())
+        for drivers in (args.drivers if uses_browser else [0]):
+            for downloads in args.downloads:
+                metrics = SampledMetrics()
+                cwd = os.getcwd()
+                with tempfile.TemporaryDirectory() as work:
+                    keywords = os.path.join(work, 'keywords.txt')
+                    with open(keywords, 'w') as out:
+                        out.writelines('keyword {}\n'.format(i) for i in range(args.keywords))
+                    #The crawler writes its dataset, index and checkpoint to the working directory
+                    os.chdir(work)
+                    try:
+                        with PeakRSS() as rss:
+                            started = time.perf_counter()
+                            #Every fake site shares one host, so a per-host limit would cap downloads
+                            with ImageCrawl(maxDownloads=downloads, perHost=downloads, drivers=drivers,
+                                            nearDup=None, sites=sites, lean=True, metrics=metrics,
+                                            scrollTarget=args.pages * args.per_page,
+                                            metricsInterval=3600) as crawl:
+                                crawl.startCrawl(JobSource(keywords, 'bench'))
+                            elapsed = time.perf_counter() - started
+                    finally:
+                        os.chdir(cwd)
+                pages = [value for name in ('page_load_seconds', 'pagination_seconds', 'scroll_seconds')
+                         for value in metrics.samples[name]]
+                fetches = metrics.samples['download_seconds']
+                rows.append({'drivers': str(drivers), 'downloads': str(downloads),
+                             'pages_s': metrics.total('pages_total') / elapsed,
+                             'images_s': metrics.total('images_total', status='saved') / elapsed,
+                             'page_p50': percentile(pages, .5), 'page_p99': percentile(pages, .99),
+                             'dl_p50': percentile(fetches, .5), 'dl_p99': percentile(fetches, .99),
+                             'peak_rss_mb': rss.peak / 2**20})
+    report('{} keywords x {} on a local server ({}s page / {}s image latency)'.format(
+               args.keywords, ','.join(sorted(sites)), args.latency, args.image_latency),
+           rows, ['drivers', 'downloads', 'pages_s', 'images_s', 'page_p50', 'page_p99',
+                  'dl_p50', 'dl_p99', 'peak_rss_mb'])
+
+
+def bench_normalize(args):
+    '''Image validation and normalisation throughput for each process pool size'''
+    from imagenorm import ImageNormalizer, iter_images
+    from fakesearch import synthetic_png
+    rows = []
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as work:
+            for i in range(args.images):
+                with open(os.path.join(work, '{}.png'.format(i)), 'wb') as out:
+                    out.write(synthetic_png(i, args.size))
+            started = time.perf_counter()
+            with ImageNormalizer(workers=workers, chunksize=args.chunksize,
+                                 sizes=tuple(args.sizes)) as normalizer:
+                done = sum(1 for _ in normalizer.batch(iter_images(work)))
+            elapsed = time.perf_counter() - started
+        rows.append({'workers': str(workers), 'images_s': done / elapsed,
+                     'speedup': 0., 'ok': str(normalizer.counts['ok'])})
+    for row in rows:
+        row['speedup'] = row['images_s'] / rows[0]['images_s']
+    report('{} {}px PNG -> JPEG{} on {} cores'.format(
+               args.images, args.size, ' + {}'.format(args.sizes) if args.sizes else '', os.cpu_count()),
+           rows, ['workers', 'images_s', 'speedup', 'ok'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    startup = commands.add_parser('startup', help=bench_startup.__doc__)
+    startup.add_argument('--runs', type=int, default=5)
+    startup.add_argument('--browser', default='chrome')
+    startup.add_argument('--url', default='about:blank')
+    startup.set_defaults(func=bench_startup)
+    warm = commands.add_parser('warm', help=bench_warm.__doc__)
+    warm.add_argument('--runs', type=int, default=5)
+    warm.add_argument('--url', default='about:blank')
+    warm.add_argument('--lean', action='store_true')
+    warm.set_defaults(func=bench_warm)
+    crawl = commands.add_parser('crawl', help=bench_crawl.__doc__)
+    crawl.add_argument('--sites', nargs='+', default=['gettyimages', 'picsearch', 'bing'])
+    crawl.add_argument('--keywords', type=int, default=20)
+    crawl.add_argument('--pages', type=int, default=4)
+    crawl.add_argument('--per-page', type=int, default=20)
+    crawl.add_argument('--latency', type=float, default=.05, help='seconds added to each result page')
+    crawl.add_argument('--image-latency', type=float, default=.02, help='seconds added to each image')
+    crawl.add_argument('--drivers', type=int, nargs='+', default=[1, 2])
+    crawl.add_argument('--downloads', type=int, nargs='+', default=[8])
+    crawl.set_defaults(func=bench_crawl)
+    normalize = commands.add_parser('normalize', help=bench_normalize.__doc__)
+    normalize.add_argument('--images', type=int, default=500)
+    normalize.add_argument('--size', type=int, default=512, help='side of the synthetic images')
+    normalize.add_argument('--sizes', type=int, nargs='*', default=[], help='resized copies to make')
+    normalize.add_argument('--chunksize', type=int, default=16)
+    normalize.add_argument('--workers', type=int, nargs='+',
+                           default=sorted({1, 2, 4, os.cpu_count()}))
+    normalize.set_defaults(func=bench_normalize)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""Warm browser daemon. Keeps pre-started WebDriver sessions that crawler processes
+lease over a small local HTTP API and attach to by session id, so a crawl starts
+without launching chromedriver, a browser or a fresh profile
+    python browserd.py --size 4 --lean --port 4455
+"""
+
+#stdlib
+import argparse
+import json
+import logging
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+#module
+from webpage import WebPage
+
+
+def session_info(page: WebPage) -> dict:
+    '''What another process needs to attach to a page's session (WebPage remote=)'''
+    driver = page.driver
+    return {'executor': driver.command_executor._url, 'session_id': driver.session_id,
+            'capabilities': driver.capabilities, 'w3c': driver.w3c}
+
+
+class BrowserDaemon:
+    """Keeps size sessions from factory started and idle, at most max_sessions in
+    all. A released session is reset (cookies cleared, reset_url loaded) and
+    reused; one that fails to reset, or is leased longer than lease_timeout,
+    is closed and replaced
+    """
+
+    def __init__(self, size: int=2, factory: 'callable'=None, max_sessions: int=None,
+                    lease_timeout: float=3600, reset_url: str='about:blank'):
+        self.factory = factory or (lambda: WebPage(url=None, browser='chrome', lean=True))
+        self.size = size
+        self.max_sessions = max_sessions or size * 2
+        self.lease_timeout = lease_timeout
+        self.reset_url = reset_url
+        self.started = 0
+        self.server = None
+        self._idle = Queue()
+        self._leased = {}
+        self._lock = Lock()
+        self._stop = Event()
+        self._filler = Thread(target=self._fill, daemon=True)
+        self._filler.start()
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+    def _fill(self):
+        while not self._stop.is_set():
+            self._reap()
+            with self._lock:
+                missing = min(self.size - self._idle.qsize(),
+                              self.max_sessions - self._idle.qsize() - len(self._leased))
+            for _ in range(max(missing, 0)):
+                if self._stop.is_set():
+                    return
+                try:
+                    page = self.factory()
+                except Exception as e:
+                    logging.warning('BD - Could not start a session: %s', e)
+                    break
+                self.started += 1
+                self._idle.put(page)
+            self._stop.wait(.5)
+
+    def _reap(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [sid for sid, (_, leased) in self._leased.items()
+                       if now - leased > self.lease_timeout]
+            pages = [self._leased.pop(sid)[0] for sid in expired]
+        for page in pages:
+            logging.warning('BD - Lease of %s expired, closing it', page.driver.session_id)
+            page.close_page()
+
+    def lease(self, timeout: float=60) -> dict:
+        '''Takes an idle session, waiting up to timeout for one. Returns its
+        session_info, or None'''
+        try:
+            page = self._idle.get(timeout=timeout)
+        except Empty:
+            return None
+        with self._lock:
+            self._leased[page.driver.session_id] = (page, time.monotonic())
+        return session_info(page)
+
+    def release(self, session_id: str, ok: bool=True) -> bool:
+        '''Returns a leased session. It is reset and reused unless ok is False'''
+        with self._lock:
+            page = self._leased.pop(session_id, (None,))[0]
+        if page is None:
+            return False
+        if ok:
+            try:
+                page.clear_cookies()
+                page.driver.get(self.reset_url)
+                if page.capture_network:
+                    page.network_images()
+            except Exception as e:
+                logging.warning('BD - Reset of %s failed: %s', session_id, e)
+                ok = False
+        if ok and self._idle.qsize() < self.size:
+            self._idle.put(page)
+        else:
+            page.close_page()
+        return True
+
+    def status(self) -> dict:
+        with self._lock:
+            return {'idle': self._idle.qsize(), 'leased': len(self._leased), 'started': self.started}
+
+    def serve(self, host: str='127.0.0.1', port: int=4455) -> str:
+        '''Serves the lease/release/status API in a background thread. Returns its URL'''
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return 'http://{}:{}'.format(*self.server.server_address[:2])
+
+    def _handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status: int, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == '/status':
+                    self._reply(200, daemon.status())
+                else:
+                    self._reply(404, {'error': 'not found'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if self.path == '/lease':
+                    session = daemon.lease(body.get('timeout', 60))
+                    self._reply(200 if session else 503, session or {'error': 'no idle session'})
+                elif self.path == '/release':
+                    found = daemon.release(body.get('session_id'), body.get('ok', True))
+                    self._reply(200 if found else 404, {'released': found})
+                else:
+                    self._reply(404, {'error': 'not found'})
+            def log_message(self, *_):
+                pass
+        return Handler
+
+    def close(self):
+        '''Stops serving and closes every session, leased or not'''
+        self._stop.set()
+        self._filler.join()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        with self._lock:
+            pages = [page for page, _ in self._leased.values()]
+            self._leased.clear()
+        while not self._idle.empty():
+            pages.append(self._idle.get())
+        for page in pages:
+            page.close_page()
+
+
+class BrowserClient:
+    """Leases sessions from a BrowserDaemon at url for WebPage(remote=...)
+    """
+
+    def __init__(self, url: str='http://127.0.0.1:4455', timeout: float=60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _call(self, path: str, body: dict=None) -> dict:
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        try:
+            with urlopen(req, timeout=self.timeout + 5) as resp:
+                return json.loads(resp.read())
+        except HTTPError as e:
+            return json.loads(e.read() or b'{}') if e.code in (404, 503) else {'error': str(e)}
+
+    def lease(self) -> dict:
+        '''Returns session info for WebPage(remote=...). Raises RuntimeError if the
+        daemon has no idle session within the timeout'''
+        session = self._call('/lease', {'timeout': self.timeout})
+        if 'session_id' not in session:
+            raise RuntimeError('browser daemon: {}'.format(session.get('error')))
+        return session
+
+    def release(self, session_id: str, ok: bool=True) -> bool:
+        return self._call('/release', {'session_id': session_id, 'ok': ok}).get('released', False)
+
+    def status(self) -> dict:
+        return self._call('/status')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=2, help='idle sessions to keep ready')
+    parser.add_argument('--max-sessions', type=int, help='idle plus leased sessions (default 2 x size)')
+    parser.add_argument('--port', type=int, default=4455)
+    parser.add_argument('--browser', default='chrome')
+    parser.add_argument('--lean', action='store_true', help='headless sessions without images, css or fonts')
+    parser.add_argument('--capture', action='store_true', help='record network events for network_images()')
+    parser.add_argument('--lease-timeout', type=float, default=3600)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    def factory():
+        return WebPage(url=None, browser=args.browser, lean=args.lean, capture_network=args.capture)
+    with BrowserDaemon(args.size, factory, args.max_sessions, args.lease_timeout) as daemon:
+        logging.info('BD - serving on %s', daemon.serve(port=args.port))
+        try:
+            while True:
+                time.sleep(60)
+                logging.info('BD - %s', daemon.status())
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
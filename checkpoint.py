@@ -0,0 +1,138 @@
+"""Resumable crawl state: finished (site, keyword) pairs, the last finished page of
+keywords in progress and the downloads still queued when the state was saved.
+Infinite-scroll sites have no pages to resume from, so an unfinished keyword on
+one of them starts over; the dedup index keeps that from refetching its images
+"""
+
+#stdlib
+import json
+import os
+import tempfile
+from threading import Lock
+
+
+class Checkpoint:
+    """Append-only JSON lines journal of finished pages and keywords, flushed and
+    fsynced every batch updates, so each update costs one short line however many
+    keywords are done. The queued downloads, which the pipeline keeps bounded, go
+    to a side file <path>.pending that is rewritten atomically at the same time
+    """
+
+    def __init__(self, path: str='crawl_checkpoint.json', batch: int=20,
+                    pending_source: 'callable'=None):
+        self.path = path
+        self.pending_path = path + '.pending'
+        self.batch = batch
+        self.pending_source = pending_source
+        self._lock = Lock()
+        self._dirty = 0
+        self._journal = None
+        self._done = set()
+        self._pages = {}
+        self._pending = []
+        self._load()
+
+    @staticmethod
+    def _key(site: str, keyword: str) -> str:
+        return site + '|' + keyword
+
+    def _apply(self, entry: dict):
+        if 'page' in entry:
+            site, keyword, page, next_url = entry['page']
+            self._pages[self._key(site, keyword)] = (page, next_url)
+        elif 'done' in entry and len(entry) == 1:
+            site, keyword = entry['done']
+            self._done.add((site, keyword))
+            self._pages.pop(self._key(site, keyword), None)
+        else:
+            #A whole-state checkpoint written before the journal format
+            self._done.update(map(tuple, entry.get('done', [])))
+            self._pages.update({key: tuple(value) for key, value in entry.get('pages', {}).items()})
+            self._pending = entry.get('pending', [])
+
+    def _load(self):
+        if os.path.isfile(self.path):
+            with open(self.path) as src:
+                for line in src:
+                    if not line.strip():
+                        continue
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        #The line being written when a crawl died
+                        continue
+        if os.path.isfile(self.pending_path):
+            with open(self.pending_path) as src:
+                self._pending = json.load(src)
+
+    def is_done(self, site: str, keyword: str) -> bool:
+        return (site, keyword) in self._done
+
+    def progress(self, site: str, keyword: str) -> tuple:
+        '''Returns (last finished page, url of the next page) or None'''
+        return self._pages.get(self._key(site, keyword))
+
+    def pending(self) -> list:
+        '''Returns the (url, filepath) downloads outstanding at the last save'''
+        return [tuple(item) for item in self._pending]
+
+    def page_done(self, site: str, keyword: str, page: int, next_url: str):
+        with self._lock:
+            self._pages[self._key(site, keyword)] = (page, next_url)
+            self._append({'page': [site, keyword, page, next_url]})
+
+    def keyword_done(self, site: str, keyword: str):
+        with self._lock:
+            self._done.add((site, keyword))
+            self._pages.pop(self._key(site, keyword), None)
+            self._append({'done': [site, keyword]})
+
+    def _append(self, entry: dict):
+        if self._journal is None:
+            #Start on a fresh line after a torn write or an old whole-state checkpoint
+            torn = False
+            if os.path.isfile(self.path) and os.path.getsize(self.path):
+                with open(self.path, 'rb') as src:
+                    src.seek(-1, os.SEEK_END)
+                    torn = src.read(1) != b'\n'
+            self._journal = open(self.path, 'a')
+            if torn:
+                self._journal.write('\n')
+        self._journal.write(json.dumps(entry) + '\n')
+        self._dirty += 1
+        if self._dirty >= self.batch:
+            self._write()
+
+    def _write(self):
+        if self._journal is not None:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        if self.pending_source is not None:
+            self._pending = [list(item) for item in self.pending_source()]
+        folder = os.path.dirname(os.path.abspath(self.pending_path))
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix='.checkpoint-')
+        with os.fdopen(fd, 'w') as out:
+            json.dump(self._pending, out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp, self.pending_path)
+        self._dirty = 0
+
+    def flush(self):
+        '''Write any unsaved updates now'''
+        with self._lock:
+            self._write()
+
+    def clear(self):
+        '''Forget all progress and remove the checkpoint files'''
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            self._done = set()
+            self._pages = {}
+            self._pending = []
+            self._dirty = 0
+            for path in (self.path, self.pending_path):
+                if os.path.isfile(path):
+                    os.remove(path)
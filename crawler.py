@@ -1,9 +1,30 @@
-from webpage import WebPage
-from time import sleep
-import re
-import csv
+from webpage import WebPage, DriverFailure
+from pipeline import ImagePipeline
+from driverpool import DriverPool
+from httpclient import HttpClient
+from staticengine import StaticEngine
+from threading import Thread, Lock
+from dedupindex import DedupIndex, normalize_url
+from phash import NearDupIndex
+from checkpoint import Checkpoint
+import argparse
+import hashlib
+from waits import result_count_stable
+from scroll import ScrollLoader
+from ratelimit import HostRateLimiter, PolitenessScheduler
+from sites import SITES
+from jobsource import JobSource, parse_shard
+from proxypool import ProxyPool
+from metrics import Metrics, MetricsReporter
+from imagenorm import ImageNormalizer
+from packstore import FileStore, PackStore
+from browserd import BrowserClient
+from manifest import Manifest
+import json
+import logging
+import time
 from pathlib import Path
-from urllib.request import urlretrieve
+from copy import copy
 import os
 from random import randint
 
@@ -12,84 +33,356 @@ class ImageCrawl:
     def __enter__(self):
         return self
 
-    def __init__(self):
+    def __init__(self,maxDownloads=8,perHost=4,drivers=1,driverFactory=None,indexPath='crawl_index.sqlite',nearDup='symlink',checkpointPath='crawl_checkpoint.json',resume=False,scrollTarget=1000,proxies=None,lean=False,profileRoot=None,captureSites=(),sites=None,metricsInterval=30,metricsFile=None,metricsPort=None,metrics=None,normalize=False,minSide=64,resizeTo=(),output='files',shardRoot='shards',shardBytes=1024**3,incremental=None,browserUrl=None,manifestRoot=None,manifestFormat='jsonl',concurrency=None,staticWorkers=4):
         self.id=0
-        self.urlDict={
-            'gettyimages':'https://www.gettyimages.in/photos/',
-            'picsearch':'https://www.picsearch.com/index.cgi?q=',
-            'bing':'https://www.bing.com/images/search?q=', #key+word       
-        }
-        self.xpathDict={
-            "gettyimages":"//figure[@class='gallery-mosaic-asset__figure']//img",
-            "bing":"//div[@class='img_cont hoff']//img",
-            "picsearch":"//span[@class='result']//img",
-        }
-        self.w=WebPage(url=None,browser='chrome')
+        #per site/keyword latencies and counts; summarised every metricsInterval seconds,
+        #appended to metricsFile as JSONL and served for Prometheus on metricsPort
+        self.metrics=metrics or Metrics()
+        self.lastSummary=(time.monotonic(),0,0)
+        #lean drivers are headless and skip images/css/fonts; profileRoot keeps their profiles between runs
+        self.lean=lean
+        self.profileRoot=profileRoot
+        self.freeProfiles=set()
+        self.profileCount=0
+        self.profileLock=Lock()
+        self.scrollTarget=scrollTarget
+        #incremental is the share of already-seen results (e.g. .8) at which a keyword's
+        #pagination stops; every page's results are stored for the next run either way
+        self.incremental=incremental
+        #site adapters from the sites registry, optionally narrowed to some names,
+        #or a dict of name -> adapter used as given (e.g. pointed at a local fake server)
+        if isinstance(sites,dict):
+            self.sites=dict(sites)
+        else:
+            self.sites={name:site for name,site in SITES.items() if sites is None or name in sites}
+        #concurrency maps a site name to its jobs in flight at once, overriding the adapter's;
+        #staticWorkers is the thread count for a browserless site without a limit
+        for name,limit in (concurrency or {}).items():
+            self.sites[name]=copy(self.sites[name])
+            self.sites[name].concurrency=limit
+        self.staticWorkers=staticWorkers
+        #sites whose image urls are read from the browser's network log instead of the DOM
+        self.captureSites=set(captureSites)
+        #browserUrl leases warm sessions from a browserd daemon instead of launching drivers;
+        #those sessions use the daemon's own launch settings (lean, capture, no proxy)
+        self.browsers=BrowserClient(browserUrl) if browserUrl else None
+        #image CDNs get the limiter defaults, search pages their site's rate
+        self.limiter=HostRateLimiter(rate=8,burst=16,limits={site.search_url:site.rate for site in self.sites.values()})
+        #proxies is a list of WebPage proxy dicts; None crawls without a proxy
+        self.proxies=ProxyPool(proxies) if proxies else None
+        #one keep-alive client shared by result pages and image downloads
+        self.http=HttpClient(max_per_host=perHost,limiter=self.limiter,proxies=self.proxies)
+        self.static=StaticEngine(self.http,max_pages=4)
+        if driverFactory is None:
+            driverFactory=self.newDriver
+        self.drivers=DriverPool(driverFactory,size=drivers,on_close=self.releaseDriver)
+        self.index=DedupIndex(indexPath)
+        #nearDup is 'symlink', 'drop' or None to keep every copy
+        self.nearDups=NearDupIndex(action=nearDup,index=self.index) if nearDup else None
+        #normalize re-encodes every image as RGB JPEG on all cores, dropping corrupt ones and
+        #those under minSide pixels; resizeTo adds square copies of those sizes next to it
+        self.normalizer=ImageNormalizer(min_side=minSide,sizes=tuple(resizeTo)) if normalize else None
+        #output 'files' keeps one file per image under dataset/keyword, 'packed' appends them
+        #to tar shards of shardBytes under shardRoot, keyed by that same relative path
+        if output=='packed':
+            self.store=PackStore(shardRoot,shard_bytes=shardBytes,near_dups=self.nearDups)
+        else:
+            self.store=FileStore(self.nearDups)
+        #manifestRoot gets a provenance row per image url under manifestRoot/run=<run id>/
+        self.manifest=Manifest(manifestRoot,fmt=manifestFormat) if manifestRoot else None
+        self.pipeline=ImagePipeline(download_workers=maxDownloads,per_host=perHost,index=self.index,client=self.http,metrics=self.metrics,normalizer=self.normalizer,store=self.store,manifest=self.manifest)
+        self.checkpoint=Checkpoint(checkpointPath,pending_source=self.pipeline.pending)
+        if resume:
+            for url,filepath in self.checkpoint.pending():
+                self.pipeline.put(url,filepath)
+        else:
+            self.checkpoint.clear()
+        self.reporter=MetricsReporter(self.metrics,interval=metricsInterval,jsonl_path=metricsFile,port=metricsPort,summary=self.metricsSummary)
     
-    def nextPage(self,site):
-        site=str(site)
-        if site=='bing':
-            self.w.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        elif site=='picsearch': 
-            self.w.driver.find_element_by_xpath("//div//a[@id='nextPage']").click()
-        elif site=='gettyimages':
-            elem=self.w.driver.find_element_by_xpath("//a[@class='search-pagination__button search-pagination__button--next']")
-            url=elem.get_attribute('href')
-            print("getty image next page url -------------->",url)
-            self.w.driver.get(url)
+    def nextPage(self,w,site):
+        return self.sites[str(site)].next_page(w,self.navigate)
     
-    def imgDownloader(self,imageElems,folderPath):
-        for imgEle in imageElems:
+    def newDriver(self):
+        if self.browsers:
+            return WebPage(url=None,browser='chrome',remote=self.browsers.lease())
+        #each new driver gets the healthiest proxy not already in heavy use
+        proxy=self.proxies.acquire() if self.proxies else None
+        return WebPage(url=None,browser='chrome',proxy=proxy,lean=self.lean,profile_dir=self.leaseProfile(),
+                       capture_network=bool(self.captureSites))
+
+    def leaseProfile(self):
+        #a chrome profile can only be open once, so each live driver gets its own directory
+        if not self.profileRoot:
+            return None
+        with self.profileLock:
+            if self.freeProfiles:
+                return self.freeProfiles.pop()
+            self.profileCount+=1
+            profile=os.path.join(self.profileRoot,'driver-%d'%self.profileCount)
+        os.makedirs(profile,exist_ok=True)
+        return profile
+
+    def releaseDriver(self,w):
+        if self.browsers and getattr(w,'remote',None):
+            #the daemon resets the session and retires it if that fails
+            self.browsers.release(w.remote['session_id'])
+            return
+        if self.proxies:
+            self.proxies.release(getattr(w,'proxy',None))
+        if self.profileRoot and getattr(w,'chrome_profile_dir',None):
+            with self.profileLock:
+                self.freeProfiles.add(w.chrome_profile_dir)
+
+    def navigate(self,w,url):
+        self.limiter.acquire(url)
+        started=time.monotonic()
+        try:
+            w.driver.get(url)
+        except Exception:
+            if self.proxies:
+                self.proxies.report(getattr(w,'proxy',None),ok=False)
+            raise
+        if self.proxies:
+            self.proxies.report(getattr(w,'proxy',None),time.monotonic()-started)
+
+    def imagePath(self,url,folderPath):
+        #named after the normalised url's hash, so two urls only share a file if the index treats them as one
+        filename=hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
+        return Path(folderPath+'/'+filename+'.jpg')
+
+    def collectUrls(self,w,key):
+        if key in self.captureSites:
+            return [image['url'] for image in w.network_images()]
+        return self.sites[key].extract_page(w)
+
+    def metricsSummary(self):
+        now=time.monotonic()
+        saved=self.metrics.total('images_total',status='saved')
+        size=self.metrics.total('download_bytes_total')
+        then,lastSaved,lastSize=self.lastSummary
+        self.lastSummary=(now,saved,size)
+        elapsed=max(now-then,1e-9)
+        downloads=self.metrics.merged('download_seconds')
+        return ('pages %d, images saved %d failed %d duplicate %d seen %d, %.1f img/s, %.1f KB/s, '
+                'download p50 <=%ss p99 <=%ss, queued %d/%d'%(
+                self.metrics.total('pages_total'),saved,self.metrics.total('images_total',status='failed'),
+                self.metrics.total('images_total',status='duplicate')+self.metrics.total('images_total',status='near_duplicate'),
+                self.metrics.total('images_total',status='seen'),(saved-lastSaved)/elapsed,(size-lastSize)/elapsed/1024,
+                downloads.quantile(.5),downloads.quantile(.99),self.pipeline.url_queue.qsize(),self.pipeline.write_queue.qsize()))
+
+    def previousResults(self,key,keyword):
+        return {url for urls in self.index.result_urls(key,keyword).values() for url in urls}
+
+    def pageSeen(self,key,keyword,page,urls,previous):
+        #stores the page's results, then tells whether they are mostly ones the last run saw
+        self.index.save_results(key,keyword,page,urls)
+        if not self.incremental or not previous or not urls:
+            return False
+        seen=sum(normalize_url(url) in previous for url in urls)/len(urls)
+        if seen<self.incremental:
+            return False
+        print(key,keyword,'page',page,'is %d%% old results, stopping'%(seen*100))
+        self.metrics.inc('recrawl_stops_total',site=key)
+        return True
+
+    def queueImages(self,urls,folderPath,labels=None,page=None,firstRank=0):
+        #the pipeline drops urls already in the dedup index before any request;
+        #rank is the url's position among all of the keyword's results on the site
+        if labels:
+            self.metrics.inc('pages_total',**labels)
+            self.metrics.inc('images_found_total',len(urls),**labels)
+        for rank,url in enumerate(urls,firstRank):
             try:
-                url=str(imgEle.get_attribute('src'))
-                print(url)
-                filename=str(re.sub(r'\W+', '', url.split('?')[1]))[:-15]
-                print(filename)
-                if not os.path.exists(folderPath):
-                    os.makedirs(folderPath)
-                filepath=Path(folderPath+'/'+filename+'.jpg')
-                if not filepath.is_file():
-                    urlretrieve(str(url),filepath)
+                self.pipeline.put(url,self.imagePath(url,folderPath),labels,{'page':page,'rank':rank})
             except Exception as e:
                 print(e)
-        
-    def hispanicStartCrawl(self):
-        makeKeyword = lambda string : string.lstrip().replace(' ','+')
-        keywords=[]
-        with open('keywordlist.csv','r') as a:
-            reader=csv.reader(a,delimiter=',')
-            for r in reader:
-                for text in r:
-                    keywords.append(makeKeyword(text.lower()))
-            print(keywords)
-        for key in self.urlDict:
-            for keyword in keywords:
-                folderPath=str(Path().absolute())+'/hispanic/'+keyword
-                print(folderPath)    
-                self.w.driver.get(self.urlDict[key]+keyword)
-                if key=='bing':
-                    for i in range(0,4): #page load for bing
-                        self.nextPage(key)
-                sleep(1)
-                imageElems = self.w.driver.find_elements_by_xpath(self.xpathDict[key])
-                print(imageElems)
-                if not key=='bing':
-                    for a in range(0,4): #page traverse number
-                        self.imgDownloader(imageElems,folderPath)
-                        self.nextPage(key)
-                        imageElems = self.w.driver.find_elements_by_xpath(self.xpathDict[key])
 
-    
+    def hispanicStartCrawl(self,shard=(0,1)):
+        self.startCrawl(JobSource('keywordlist.csv','hispanic',shard))
+
+    def startCrawl(self,source):
+        #keywords are streamed from the source per site, never loaded as a whole list
+        staticSites=[key for key,site in self.sites.items() if not site.requires_js]
+        staticThread=Thread(target=self.runStatic,args=(self.schedule(staticSites,source),))
+        staticThread.start()
+        jobs=self.schedule([key for key,site in self.sites.items() if site.requires_js],source)
+        try:
+            self.drivers.run(jobs,self.crawlKeyword,on_done=lambda job: jobs.done(job[0]))
+        finally:
+            staticThread.join()
+
+    def schedule(self,keys,source):
+        #interleave sites so no single host takes all the drivers at once
+        return PolitenessScheduler({key:(self.sites[key].search_url,source.jobs(key),self.sites[key].concurrency) for key in keys},self.limiter)
+
+    def runStatic(self,jobs):
+        #browserless jobs run on plain threads, as many as the static sites allow at once
+        lock=Lock()
+        jobIter=iter(jobs)
+        def work():
+            while True:
+                with lock:
+                    job=next(jobIter,None)
+                if job is None:
+                    return
+                try:
+                    self.crawlStatic(*job)
+                finally:
+                    jobs.done(job[0])
+        threads=[Thread(target=work) for _ in range(sum(self.sites[name].concurrency or self.staticWorkers for name in jobs.limits))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def crawlStatic(self,key,keyword,dataset='hispanic'):
+        if self.checkpoint.is_done(key,keyword):
+            return
+        folderPath=str(Path().absolute())+'/'+dataset+'/'+keyword
+        startPage,url=0,self.sites[key].search_url_for(keyword)
+        if self.checkpoint.progress(key,keyword):
+            lastPage,url=self.checkpoint.progress(key,keyword)
+            startPage=lastPage+1
+        labels={'site':key,'keyword':keyword}
+        previous=self.previousResults(key,keyword)
+        ranked=0
+        try:
+            started=time.perf_counter()
+            for page,urls,nextUrl in self.static.crawl(self.sites[key],url,startPage):
+                self.metrics.observe('page_load_seconds',time.perf_counter()-started,site=key)
+                print(key,keyword,page,len(urls))
+                self.queueImages(urls,folderPath,labels,page,ranked)
+                ranked+=len(urls)
+                self.checkpoint.page_done(key,keyword,page,nextUrl)
+                if self.pageSeen(key,keyword,page,urls,previous):
+                    break
+                started=time.perf_counter()
+            self.checkpoint.keyword_done(key,keyword)
+        except Exception as e:
+            print(e)
+
+    def crawlKeyword(self,w,key,keyword,dataset='hispanic'):
+        if self.checkpoint.is_done(key,keyword):
+            return
+        if self.proxies and not self.proxies.healthy(getattr(w,'proxy',None)) and self.proxies.any_healthy():
+            #the driver pool swaps this driver for one on a healthier proxy; with every
+            #proxy benched a new driver would be no better, so the job runs on this one
+            raise DriverFailure('proxy {} is slow or blocked'.format(w.proxy['ip']))
+        folderPath=str(Path().absolute())+'/'+dataset+'/'+keyword
+        print(folderPath)    
+        site=self.sites[key]
+        #a resumed keyword continues from the page after the last finished one
+        startPage,url=0,site.search_url_for(keyword)
+        if self.checkpoint.progress(key,keyword):
+            lastPage,url=self.checkpoint.progress(key,keyword)
+            startPage=lastPage+1
+        labels={'site':key,'keyword':keyword}
+        previous=self.previousResults(key,keyword)
+        trips=getattr(w,'round_trips',0)
+        ranked=0
+        try:
+            if key in self.captureSites:
+                w.network_images() #drop whatever the previous job left in the log
+            started=time.perf_counter()
+            self.navigate(w,url)
+            if site.infinite_scroll:
+                #infinite scroll: queue each batch of new results as it appears. There is no
+                #page url to resume from, so an unfinished keyword starts over on --resume
+                #and the dedup index skips the images it already fetched
+                loader=ScrollLoader(w,site.img_xpath,target=self.scrollTarget,capture=key in self.captureSites)
+                timer='page_load_seconds'
+                for batch,urls in enumerate(loader.stream()):
+                    self.metrics.observe(timer,time.perf_counter()-started,site=key)
+                    print(key,keyword,len(urls))
+                    self.queueImages(urls,folderPath,labels,batch,ranked)
+                    ranked+=len(urls)
+                    #each scroll batch counts as a page when comparing with the last run
+                    if self.pageSeen(key,keyword,batch,urls,previous):
+                        break
+                    timer,started='scroll_seconds',time.perf_counter()
+            else:
+                w.wait(result_count_stable(site.img_xpath))
+                self.metrics.observe('page_load_seconds',time.perf_counter()-started,site=key)
+                urls = self.collectUrls(w,key)
+                print(len(urls))
+                for a in range(startPage,site.max_pages): #page traverse number
+                    self.queueImages(urls,folderPath,labels,a,ranked)
+                    ranked+=len(urls)
+                    #the last allowed page needs no navigation past it
+                    if self.pageSeen(key,keyword,a,urls,previous) or a+1>=site.max_pages:
+                        break
+                    started=time.perf_counter()
+                    if not self.nextPage(w,key):
+                        break
+                    w.wait(result_count_stable(site.img_xpath))
+                    self.metrics.observe('pagination_seconds',time.perf_counter()-started,site=key)
+                    self.checkpoint.page_done(key,keyword,a,w.get_page())
+                    urls = self.collectUrls(w,key)
+            self.checkpoint.keyword_done(key,keyword)
+        finally:
+            self.metrics.inc('webdriver_round_trips_total',getattr(w,'round_trips',0)-trips,**labels)
+
     def blackStartCrawl(self):
         pass
 
                     
 
     def __exit__(self,exception_type, exception_value, traceback):
-        print("quiting driver.................")
-        self.w.driver.quit()
+        #save what is still queued before draining, in case the drain is interrupted
+        self.checkpoint.flush()
+        print("waiting for downloads..........")
+        self.pipeline.close()
+        if self.normalizer:
+            self.normalizer.close()
+        if self.manifest:
+            self.manifest.close()
+        self.checkpoint.flush()
+        print("saved",self.pipeline.saved,"failed",dict(self.pipeline.failures))
+        self.reporter.close()
+        self.index.close()
+        print("quiting drivers................")
+        self.drivers.close()
+        self.http.close()
 
 if __name__=='__main__':
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--keywords',default='keywordlist.csv',help='keyword file (.csv, .jsonl or one keyword per line)')
+    parser.add_argument('--dataset',default='hispanic',help='output folder / dataset name')
+    parser.add_argument('--field',help='JSONL field holding the keyword (default: keyword, then title)')
+    parser.add_argument('--shard',default='0/1',type=parse_shard,help='index/count of this node, e.g. 3/16')
+    parser.add_argument('--resume',action='store_true',help='continue from the last checkpoint; infinite-scroll sites (bing) restart unfinished keywords from the top')
+    parser.add_argument('--drivers',type=int,default=1,help='browsers crawling in parallel')
+    parser.add_argument('--downloads',type=int,default=8,help='images downloaded in parallel')
+    parser.add_argument('--concurrency',nargs='*',default=[],metavar='SITE=N',help='jobs in flight at once for a site, e.g. bing=4 (default: browser sites share all drivers)')
+    parser.add_argument('--lean',action='store_true',help='headless drivers that skip images, css, fonts and media')
+    parser.add_argument('--profiles',help='directory to keep reusable chrome profiles in')
+    parser.add_argument('--capture',nargs='*',default=[],help='sites to read image urls from the network log for')
+    parser.add_argument('--proxies',help='JSON file with a list of proxy dicts (ip, port, is_socks5, sticky_ip_header, check_url)')
+    parser.add_argument('--metrics-interval',type=float,default=30,help='seconds between metric summary lines')
+    parser.add_argument('--metrics-file',help='append a JSONL metrics snapshot here every interval')
+    parser.add_argument('--metrics-port',type=int,help='serve Prometheus metrics on this local port')
+    parser.add_argument('--normalize',action='store_true',help='validate and re-encode images as RGB JPEG on a process pool')
+    parser.add_argument('--min-side',type=int,default=64,help='with --normalize, reject images smaller than this')
+    parser.add_argument('--sizes',type=int,nargs='*',default=[],help='with --normalize, also save square copies of these sizes')
+    parser.add_argument('--output',choices=['files','packed'],default='files',help='one file per image, or tar shards')
+    parser.add_argument('--shard-root',default='shards',help='with --output packed, directory for the shards')
+    parser.add_argument('--shard-mb',type=int,default=1024,help='with --output packed, roll to a new shard after this many MiB')
+    parser.add_argument('--incremental',type=float,nargs='?',const=.8,help='stop paginating a keyword once this share of a page (default .8) was seen last run')
+    parser.add_argument('--browser-daemon',help='URL of a browserd daemon to lease warm sessions from, e.g. http://127.0.0.1:4455')
+    parser.add_argument('--manifest',help='directory for the provenance manifest, partitioned by run')
+    parser.add_argument('--manifest-format',choices=['jsonl','parquet'],default='jsonl',help='parquet needs pyarrow')
+    args=parser.parse_args()
+    logging.basicConfig(level=logging.INFO,format='%(asctime)s %(levelname)s %(message)s')
+    proxies=None
+    if args.proxies:
+        with open(args.proxies) as a:
+            proxies=json.load(a)
 
-    with ImageCrawl() as im:
-        im.hispanicStartCrawl()
+    concurrency={site:int(limit) for site,limit in (item.split('=',1) for item in args.concurrency)}
+    with ImageCrawl(maxDownloads=args.downloads,drivers=args.drivers,concurrency=concurrency,resume=args.resume,proxies=proxies,lean=args.lean,profileRoot=args.profiles,captureSites=args.capture,
+                   metricsInterval=args.metrics_interval,metricsFile=args.metrics_file,metricsPort=args.metrics_port,
+                   normalize=args.normalize,minSide=args.min_side,resizeTo=args.sizes,
+                   output=args.output,shardRoot=args.shard_root,shardBytes=args.shard_mb*1024**2,
+                   incremental=args.incremental,browserUrl=args.browser_daemon,
+                   manifestRoot=args.manifest,manifestFormat=args.manifest_format) as im:
+        im.startCrawl(JobSource(args.keywords,args.dataset,args.shard,args.field))
@@ -0,0 +1,115 @@
+"""Persistent dedup index of image URLs and content hashes shared across runs,
+plus the ordered result URLs of every crawled page for incremental re-crawls
+"""
+
+#stdlib
+import hashlib
+import sqlite3
+import time
+from threading import Lock
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url: str) -> str:
+    '''Lowercases scheme and host, drops default ports and fragments and sorts the query'''
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host += ':' + str(parts.port)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+def content_hash(data: bytes) -> str:
+    '''Returns the hex SHA-1 of some bytes'''
+    return hashlib.sha1(data).hexdigest()
+
+
+class DedupIndex:
+    """SQLite backed set of seen URLs and content hashes. Safe to share between threads
+    """
+
+    def __init__(self, path: str='crawl_index.sqlite'):
+        self.path = path
+        self._lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS urls '
+                              '(url TEXT PRIMARY KEY, sha1 TEXT, path TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS contents '
+                              '(sha1 TEXT PRIMARY KEY, path TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS phashes '
+                              '(phash TEXT, path TEXT PRIMARY KEY)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS rejected '
+                              '(url TEXT PRIMARY KEY, sha1 TEXT, reason TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS pages '
+                              '(site TEXT, keyword TEXT, page INTEGER, urls TEXT, crawled REAL, '
+                              'PRIMARY KEY (site, keyword, page))')
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+    def seen_url(self, url: str) -> bool:
+        '''True if the normalised URL was already downloaded, or rejected as unusable'''
+        url = normalize_url(url)
+        with self._lock:
+            row = self.conn.execute('SELECT 1 FROM urls WHERE url=? UNION ALL '
+                                    'SELECT 1 FROM rejected WHERE url=?', (url, url)).fetchone()
+        return row is not None
+
+    def content_path(self, sha1: str) -> str:
+        '''Returns where a content hash was first saved, or None'''
+        with self._lock:
+            row = self.conn.execute('SELECT path FROM contents WHERE sha1=?', (sha1,)).fetchone()
+        return row[0] if row else None
+
+    def add(self, url: str, sha1: str, path: str) -> bool:
+        '''Records a download. Returns False if the content was already known'''
+        with self._lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO urls VALUES (?,?,?)',
+                              (normalize_url(url), sha1, str(path)))
+            cur = self.conn.execute('INSERT OR IGNORE INTO contents VALUES (?,?)',
+                                    (sha1, str(path)))
+        return cur.rowcount == 1
+
+    def add_rejected(self, url: str, sha1: str, reason: str):
+        '''Records a download that was thrown away (e.g. too small or corrupt)'''
+        with self._lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO rejected VALUES (?,?,?)',
+                              (normalize_url(url), sha1, reason))
+
+    def add_phash(self, phash: int, path: str):
+        '''Records the perceptual hash of a kept image'''
+        with self._lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO phashes VALUES (?,?)',
+                              ('{:016x}'.format(phash), str(path)))
+
+    def phashes(self) -> list:
+        '''Returns (phash, path) for every kept image'''
+        with self._lock:
+            rows = self.conn.execute('SELECT phash, path FROM phashes').fetchall()
+        return [(int(phash, 16), path) for phash, path in rows]
+
+    def save_results(self, site: str, keyword: str, page: int, urls: list):
+        '''Stores the ordered result URLs of one page, replacing the previous run's'''
+        with self._lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO pages VALUES (?,?,?,?,?)',
+                              (site, keyword, page, '\n'.join(normalize_url(url) for url in urls),
+                               time.time()))
+
+    def result_urls(self, site: str, keyword: str) -> dict:
+        '''Returns page -> ordered normalised result URLs from the last crawl of a keyword'''
+        with self._lock:
+            rows = self.conn.execute('SELECT page, urls FROM pages WHERE site=? AND keyword=?',
+                                     (site, keyword)).fetchall()
+        return {page: urls.split('\n') if urls else [] for page, urls in rows}
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
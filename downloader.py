@@ -0,0 +1,152 @@
+"""Per-host concurrency limits for image fetches, and the streaming writer that
+checks and atomically saves each response
+"""
+
+#stdlib
+import hashlib
+import os
+import struct
+import tempfile
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlsplit
+
+#Leading bytes of the image formats we keep and the extension each is saved with
+MAGIC_BYTES = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+    (b'BM', '.bmp'),
+)
+MAX_BYTES = 10 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class DownloadRejected(Exception):
+    """Raised when a response is not an image we want to keep
+    """
+
+
+def sniff_extension(head: bytes) -> str:
+    '''Returns the file extension for the image format in head, or None'''
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    for magic, ext in MAGIC_BYTES:
+        if head.startswith(magic):
+            return ext
+    return None
+
+
+#JPEG start-of-frame markers, which carry the image size
+JPEG_SOF = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
+
+
+def image_dimensions(head: bytes) -> tuple:
+    '''Returns (width, height) read from the header bytes of a JPEG, PNG, GIF,
+    BMP or WebP image without decoding it, or (None, None)'''
+    ext = sniff_extension(head)
+    try:
+        if ext == '.png':
+            return struct.unpack('>II', head[16:24])
+        if ext == '.gif':
+            return struct.unpack('<HH', head[6:10])
+        if ext == '.bmp':
+            width, height = struct.unpack('<ii', head[18:26])
+            return width, abs(height)
+        if ext == '.webp':
+            chunk = head[12:16]
+            if chunk == b'VP8 ':
+                width, height = struct.unpack('<HH', head[26:30])
+                return width & 0x3fff, height & 0x3fff
+            if chunk == b'VP8L':
+                bits = int.from_bytes(head[21:25], 'little')
+                return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+            if chunk == b'VP8X':
+                return (int.from_bytes(head[24:27], 'little') + 1,
+                        int.from_bytes(head[27:30], 'little') + 1)
+        if ext == '.jpg':
+            i = 2
+            while i + 9 <= len(head):
+                if head[i] != 0xff:
+                    i += 1
+                    continue
+                marker = head[i + 1]
+                if marker in JPEG_SOF:
+                    height, width = struct.unpack('>HH', head[i + 5:i + 9])
+                    return width, height
+                if marker == 0xff:
+                    i += 1
+                elif marker in (0x01, 0xd8) or 0xd0 <= marker <= 0xd7:
+                    i += 2
+                else:
+                    i += 2 + struct.unpack('>H', head[i + 2:i + 4])[0]
+    except struct.error:
+        pass
+    return None, None
+
+
+def stream_to_temp(resp, folder: str, max_bytes: int=MAX_BYTES,
+                    chunk_size: int=CHUNK_SIZE, content_types: tuple=('image/',)) -> tuple:
+    '''Streams a response body into a temp file in folder, checking its Content-Type,
+    size and magic bytes on the way. Returns (temp_path, extension, sha1, size)
+    '''
+    ctype = (resp.headers.get('Content-Type') or '').lower()
+    if content_types and not ctype.startswith(content_types):
+        raise DownloadRejected('unwanted content type "{}"'.format(ctype))
+    length = resp.headers.get('Content-Length')
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise DownloadRejected('{} bytes is over the {} byte limit'.format(length, max_bytes))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix='.', suffix='.part')
+    digest, size, ext = hashlib.sha1(), 0, None
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = resp.read(chunk_size)
+                if not chunk:
+                    break
+                if ext is None:
+                    ext = sniff_extension(chunk)
+                    if ext is None:
+                        raise DownloadRejected('body is not a known image format')
+                size += len(chunk)
+                if size > max_bytes:
+                    raise DownloadRejected('body is over the {} byte limit'.format(max_bytes))
+                digest.update(chunk)
+                out.write(chunk)
+        if ext is None:
+            raise DownloadRejected('empty body')
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return tmp, ext, digest.hexdigest(), size
+
+
+def final_path(filepath: str, ext: str) -> str:
+    '''Swaps the extension of filepath for the sniffed one'''
+    return os.path.splitext(str(filepath))[0] + ext
+
+
+def host_of(url: str) -> str:
+    '''Returns the lowercase network location of a URL'''
+    return urlsplit(url).netloc.lower()
+
+
+class HostLimiter:
+    """Caps the number of simultaneous requests made to any one host
+    """
+
+    def __init__(self, per_host: int=4):
+        self.per_host = per_host
+        self._lock = Lock()
+        self._slots = defaultdict(lambda: BoundedSemaphore(self.per_host))
+
+    @contextmanager
+    def slot(self, url: str) -> 'generator-with':
+        '''Hold one of the per-host slots for the duration of the block'''
+        with self._lock:
+            sem = self._slots[host_of(url)]
+        with sem:
+            yield
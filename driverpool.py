@@ -0,0 +1,181 @@
+"""Pool of WebPage drivers that crawl (site, keyword) jobs in parallel.
+Any object with a close_page() method can stand in for a WebPage, which keeps the
+pool testable with a fake driver factory
+"""
+
+#stdlib
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+#module
+from webpage import DriverFailure
+
+_STOP = object()
+
+
+def driver_errors() -> tuple:
+    '''DriverFailure, plus selenium's WebDriverException once selenium is loaded.
+    Nothing can have raised a WebDriverException before that, so selenium is never
+    imported just to catch one'''
+    exceptions = sys.modules.get('selenium.common.exceptions')
+    return (DriverFailure,) + ((exceptions.WebDriverException,) if exceptions else ())
+
+
+class NoDriversLeft(Exception):
+    """Raised when every driver has failed and none could be started again
+    """
+
+
+class DriverPool:
+    """Starts size drivers from factory and leases them out one job at a time.
+    A driver that raises one of the failures types (by default driver_errors())
+    is closed and replaced; a replacement that fails to start is retried restarts
+    times with doubling delays from backoff seconds before the pool gives up on it
+    """
+
+    def __init__(self, factory: 'callable', size: int=1, failures: tuple=None,
+                    on_close: 'callable'=None, restarts: int=3, backoff: float=1.):
+        self.factory = factory
+        self.on_close = on_close
+        self.size = size
+        self._failures = tuple(failures) if failures is not None else None
+        self.restarts = restarts
+        self.backoff = backoff
+        self.replaced = 0
+        #Drivers that are idle, leased or being replaced
+        self.live = size
+        self._idle = Queue()
+        self._all = []
+        self._lock = Lock()
+        for _ in range(size):
+            self._idle.put(self._start())
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+    @property
+    def failures(self) -> tuple:
+        #Only evaluated when an except clause is matched, after selenium raised if it ever will
+        return self._failures if self._failures is not None else driver_errors()
+
+    def _start(self):
+        driver = self.factory()
+        with self._lock:
+            self._all.append(driver)
+        return driver
+
+    def _restart(self):
+        delay = self.backoff
+        for attempt in range(self.restarts + 1):
+            try:
+                return self._start()
+            except Exception as e:
+                logging.warning('DP - Could not start a replacement driver (attempt %d): %s',
+                                attempt + 1, e)
+            if attempt < self.restarts:
+                time.sleep(delay)
+                delay *= 2
+        with self._lock:
+            self.live -= 1
+        return None
+
+    def _shutdown(self, driver):
+        try:
+            driver.close_page()
+        except Exception:
+            pass
+        if self.on_close is not None:
+            self.on_close(driver)
+
+    def _discard(self, driver):
+        with self._lock:
+            if driver in self._all:
+                self._all.remove(driver)
+        self._shutdown(driver)
+
+    @contextmanager
+    def lease(self) -> 'generator-with':
+        '''Borrow an idle driver, replacing it if it fails inside the block.
+        Raises NoDriversLeft once no driver is left to wait for'''
+        while True:
+            try:
+                driver = self._idle.get(timeout=.5)
+                break
+            except Empty:
+                if self.live <= 0:
+                    raise NoDriversLeft('every driver failed and could not be restarted')
+        try:
+            yield driver
+        except self.failures:
+            logging.warning('DP - Replacing failed driver')
+            self._discard(driver)
+            self.replaced += 1
+            driver = None
+            raise
+        finally:
+            if driver is None:
+                driver = self._restart()
+            if driver is not None:
+                self._idle.put(driver)
+
+    def run(self, jobs: 'iterable', worker: 'callable', on_done: 'callable'=None):
+        '''Calls worker(driver, *job) for every job using all pooled drivers.
+        A job whose driver fails is retried once on the replacement driver.
+        on_done(job) is called once per job after its last attempt.
+        Raises NoDriversLeft, without taking further jobs, once every driver is gone
+        '''
+        queue = Queue(maxsize=self.size * 2)
+        exhausted = Event()
+
+        def consume():
+            while True:
+                job = queue.get()
+                if job is _STOP:
+                    break
+                if exhausted.is_set():
+                    #Keep draining so the feeder never blocks on a full queue
+                    if on_done is not None:
+                        on_done(job)
+                    continue
+                for attempt in range(2):
+                    try:
+                        with self.lease() as driver:
+                            worker(driver, *job)
+                        break
+                    except NoDriversLeft as e:
+                        logging.warning('DP - %s not crawled: %s', job, e)
+                        exhausted.set()
+                        break
+                    except self.failures as e:
+                        logging.warning('DP - %s failed on attempt %d: %s', job, attempt + 1, e)
+                    except Exception as e:
+                        logging.warning('DP - %s: %s', job, e)
+                        break
+                if on_done is not None:
+                    on_done(job)
+
+        threads = [Thread(target=consume, daemon=True) for _ in range(self.size)]
+        for thread in threads:
+            thread.start()
+        for job in jobs:
+            if exhausted.is_set():
+                break
+            queue.put(job)
+        for _ in threads:
+            queue.put(_STOP)
+        for thread in threads:
+            thread.join()
+        if exhausted.is_set():
+            raise NoDriversLeft('every driver failed and could not be restarted')
+
+    def close(self):
+        '''Shut down every driver the pool started'''
+        with self._lock:
+            drivers, self._all = self._all, []
+        for driver in drivers:
+            self._shutdown(driver)
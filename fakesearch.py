@@ -0,0 +1,168 @@
+"""Local stand-in for the image search sites, used by the offline benchmarks.
+Serves result pages in the markup each site adapter's XPaths expect, with
+next-page links, an infinite-scroll page, configurable latency and synthetic PNGs
+"""
+
+#stdlib
+import random
+import struct
+import time
+import zlib
+from collections import Counter
+from copy import copy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+#module
+from sites import SITES
+
+BING_SCROLL_JS = '''
+var loading = false, next = %d, total = %d;
+window.addEventListener('scroll', function () {
+    if (loading || next >= total) { return; }
+    if (window.innerHeight + window.scrollY < document.body.scrollHeight - 50) { return; }
+    loading = true;
+    fetch('/images/async?q=%s&first=' + next).then(function (r) { return r.text(); })
+        .then(function (html) {
+            document.getElementById('results').insertAdjacentHTML('beforeend', html);
+            next += %d;
+            loading = false;
+        });
+});
+'''
+
+
+def synthetic_png(seed: int, size: int=64) -> bytes:
+    '''Returns a valid size x size RGB PNG of pseudo-random pixels, unique per seed'''
+    rows = random.Random(seed)
+    raw = b''.join(b'\x00' + rows.randbytes(size * 3) for _ in range(size))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 1))
+            + chunk(b'IEND', b''))
+
+
+class FakeSearchServer:
+    """Threaded HTTP server imitating gettyimages, picsearch and bing result pages.
+    Every keyword has pages result pages of per_page images. latency is added to
+    each result page response and image_latency to each image response
+    """
+
+    def __init__(self, latency: float=0, image_latency: float=0, pages: int=4,
+                    per_page: int=20, image_size: int=64, host: str='127.0.0.1', port: int=0):
+        self.latency = latency
+        self.image_latency = image_latency
+        self.pages = pages
+        self.per_page = per_page
+        self.image_size = image_size
+        self.requests = Counter()
+        self._lock = Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.url = 'http://{}:{}'.format(*self.httpd.server_address[:2])
+        self._thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+    def sites(self, rate: tuple=(1000, 1000)) -> dict:
+        '''Copies of the registered adapters pointed at this server. rate replaces
+        their politeness limit, since every fake site shares one host'''
+        paths = {'gettyimages': '/photos/', 'picsearch': '/index.cgi?q=',
+                 'bing': '/images/search?q='}
+        adapters = {}
+        for name, path in paths.items():
+            site = copy(SITES[name])
+            site.search_url = self.url + path
+            site.rate = rate
+            site.max_pages = self.pages
+            adapters[name] = site
+        return adapters
+
+    def _images(self, site: str, keyword: str, first: int, count: int) -> list:
+        return ['/img/{}/{}/{}.png'.format(site, quote(keyword), rank)
+                for rank in range(first, first + count)]
+
+    def getty_page(self, keyword: str, page: int) -> str:
+        figures = ''.join("<figure class='gallery-mosaic-asset__figure'><a><img src='{}'></a></figure>"
+                          .format(src) for src in self._images('gettyimages', keyword,
+                                                               page * self.per_page, self.per_page))
+        link = ''
+        if page + 1 < self.pages:
+            link = ("<a class='search-pagination__button search-pagination__button--next' "
+                    "href='/photos/{}?page={}'>Next</a>".format(quote(keyword), page + 1))
+        return '<html><body><div>{}</div>{}</body></html>'.format(figures, link)
+
+    def picsearch_page(self, keyword: str, page: int) -> str:
+        results = ''.join("<span class='result'><a><img src='{}'></a></span>"
+                          .format(src) for src in self._images('picsearch', keyword,
+                                                               page * self.per_page, self.per_page))
+        link = ''
+        if page + 1 < self.pages:
+            link = "<div><a id='nextPage' href='/index.cgi?q={}&amp;start={}'>Next</a></div>".format(
+                quote(keyword), page + 1)
+        return '<html><body>{}{}</body></html>'.format(results, link)
+
+    def bing_results(self, keyword: str, first: int) -> str:
+        return ''.join("<div class='img_cont hoff'><img src='{}'></div>"
+                       .format(src) for src in self._images('bing', keyword, first, self.per_page))
+
+    def bing_page(self, keyword: str) -> str:
+        #Tall results so the page is always scrollable, more results appended on scroll
+        script = BING_SCROLL_JS % (self.per_page, self.pages * self.per_page,
+                                   quote(keyword), self.per_page)
+        return ('<html><head><style>.img_cont{{height:300px}}</style></head><body>'
+                "<div id='results'>{}</div><script>{}</script></body></html>"
+                .format(self.bing_results(keyword, 0), script))
+
+    def route(self, path: str) -> tuple:
+        '''Returns (status, content type, body, delay) for a request path'''
+        parts = urlsplit(path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        if parts.path.startswith('/img/'):
+            seed = zlib.crc32(parts.path.encode('utf-8'))
+            return 200, 'image/png', synthetic_png(seed, self.image_size), self.image_latency
+        if parts.path.startswith('/photos/'):
+            keyword = unquote(parts.path[len('/photos/'):])
+            html = self.getty_page(keyword, int(query.get('page', 0)))
+        elif parts.path == '/index.cgi':
+            html = self.picsearch_page(query.get('q', ''), int(query.get('start', 0)))
+        elif parts.path == '/images/search':
+            html = self.bing_page(query.get('q', ''))
+        elif parts.path == '/images/async':
+            html = self.bing_results(query.get('q', ''), int(query.get('first', 0)))
+        else:
+            return 404, 'text/plain', b'not found', 0
+        return 200, 'text/html; charset=utf-8', html.encode('utf-8'), self.latency
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                status, kind, body, delay = server.route(self.path)
+                with server._lock:
+                    server.requests[kind.split(';')[0]] += 1
+                if delay:
+                    time.sleep(delay)
+                self.send_response(status)
+                self.send_header('Content-Type', kind)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *_):
+                pass
+        return Handler
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,269 @@
+"""Small keep-alive HTTP client that reuses connections per host and retries
+throttled or failed requests with exponential backoff.
+Used for result pages that do not need a browser and for image fetches
+"""
+
+#stdlib
+import http.client
+import logging
+import time
+from base64 import b64encode
+from email.utils import parsedate_to_datetime
+from queue import LifoQueue, Empty, Full
+from threading import Lock
+from urllib.parse import urlsplit, urljoin
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)',
+    'Accept': '*/*',
+    'Connection': 'keep-alive',
+}
+REDIRECTS = (301, 302, 303, 307, 308)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class HttpError(Exception):
+    """Raised when a request still fails after every retry
+    """
+    def __init__(self, url: str, status: int=None, reason: str=''):
+        super().__init__()
+        self.url = url
+        self.status = status
+        self.reason = reason
+    def __str__(self):
+        if self.status:
+            return 'HTTP {} {}'.format(self.status, self.reason).strip()
+        return self.reason
+
+
+class Response:
+    """Status, headers and body of a completed request"""
+
+    def __init__(self, url: str, status: int, headers: dict, body: bytes):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    def text(self, encoding: str='utf-8') -> str:
+        return self.body.decode(encoding, errors='replace')
+
+
+class StreamResponse:
+    """Open response whose body is read incrementally. The connection goes back
+    to its pool when the block exits, provided the body was read to the end
+    """
+
+    def __init__(self, client: 'HttpClient', key: tuple, conn, resp, url: str):
+        self.client = client
+        self.key = key
+        self.conn = conn
+        self.resp = resp
+        self.url = url
+        self.status = resp.status
+        self.headers = resp.headers
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+    def read(self, amt: int=None) -> bytes:
+        return self.resp.read(amt)
+
+    def close(self):
+        reusable = self.resp.isclosed() and not self.resp.will_close
+        if not reusable:
+            self.resp.close()
+        self.client.release(*self.key, self.conn, reusable)
+
+
+def retry_after(value: str) -> float:
+    '''Returns the seconds to wait from a Retry-After header value, or None'''
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0., parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpClient:
+    """Keeps up to max_per_host idle connections open for every scheme://host.
+    Responses with a RETRY_STATUSES code and connection errors are retried up to
+    retries times, waiting backoff * 2**attempt seconds or the server's Retry-After.
+    HTTP/1.1 keep-alive only: pipelining and HTTP/2 are not available in http.client.
+    With a ProxyPool, new connections go through its healthiest HTTP proxy
+    (SOCKS5 proxies are skipped) and every request's latency is reported back
+    """
+
+    def __init__(self, max_per_host: int=4, timeout: int=30, headers: dict=None,
+                    retries: int=3, backoff: float=.5, max_backoff: float=30,
+                    sleep: 'callable'=time.sleep, limiter: 'HostRateLimiter'=None,
+                    proxies: 'ProxyPool'=None):
+        self.max_per_host = max_per_host
+        self.limiter = limiter
+        self.proxies = proxies
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.headers = dict(DEFAULT_HEADERS)
+        if headers:
+            self.headers.update(headers)
+        self._pools = {}
+        self._lock = Lock()
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+    def _pool(self, key: tuple) -> LifoQueue:
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = LifoQueue(maxsize=self.max_per_host)
+            return self._pools[key]
+
+    def _connect(self, scheme: str, netloc: str):
+        proxy = self.proxies.pick() if self.proxies is not None else None
+        if proxy and proxy.get('is_socks5') == 1:
+            proxy = None
+        conn_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        if not proxy:
+            conn = conn_class(netloc, timeout=self.timeout)
+            conn.proxy = conn.proxy_auth = None
+            return conn
+        auth = {}
+        if '@' in proxy['ip']:
+            creds = b64encode(proxy['ip'].split('@')[0].encode('ascii')).decode('ascii')
+            auth = {'Proxy-Authorization': 'Basic ' + creds}
+        conn = conn_class(proxy['ip'].split('@')[-1], int(proxy['port']), timeout=self.timeout)
+        if scheme == 'https':
+            conn.set_tunnel(netloc, headers=auth)
+            auth = {}
+        conn.proxy, conn.proxy_auth = proxy, auth
+        return conn
+
+    def acquire(self, scheme: str, netloc: str) -> tuple:
+        '''Returns (connection, reused) for a host, reusing an idle one if possible'''
+        try:
+            return self._pool((scheme, netloc)).get_nowait(), True
+        except Empty:
+            return self._connect(scheme, netloc), False
+
+    def release(self, scheme: str, netloc: str, conn, reusable: bool=True):
+        '''Return a connection to its host pool, or close it.
+        Connections through a proxy that has turned unhealthy are always closed'''
+        if reusable and self.proxies is not None and not self.proxies.healthy(conn.proxy):
+            reusable = False
+        if reusable:
+            try:
+                self._pool((scheme, netloc)).put_nowait(conn)
+                return
+            except Full:
+                pass
+        conn.close()
+
+    def _send(self, url: str, method: str, headers: dict) -> tuple:
+        '''Sends one request. Returns (pool key, connection, response) with the body unread'''
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        send = dict(self.headers)
+        if headers:
+            send.update(headers)
+        for attempt in range(2):
+            conn, reused = self.acquire(*key)
+            try:
+                if conn.proxy_auth is not None and parts.scheme == 'http':
+                    #Plain HTTP through a proxy sends the absolute URL
+                    conn.request(method, url, headers=dict(send, **conn.proxy_auth))
+                else:
+                    conn.request(method, path, headers=send)
+                return key, conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                conn.close()
+                #A pooled connection may have been closed by the server while idle
+                if not reused or attempt:
+                    e.proxy = conn.proxy
+                    raise
+            except Exception as e:
+                conn.close()
+                e.proxy = conn.proxy
+                raise
+
+    def _delay(self, attempt: int, resp=None) -> float:
+        wait = retry_after(resp.getheader('Retry-After')) if resp is not None else None
+        if wait is None:
+            wait = self.backoff * 2 ** attempt
+        return min(wait, self.max_backoff)
+
+    def open(self, url: str, method: str='GET', headers: dict=None,
+                redirects: int=5) -> StreamResponse:
+        '''Sends a request, retrying and following redirects, and returns the open
+        response for streaming. Raises HttpError only when the connection keeps
+        failing; once retries on 429/5xx run out the last response is returned
+        as is, so callers must check its status'''
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire(url)
+            started = time.monotonic()
+            try:
+                key, conn, resp = self._send(url, method, headers)
+                if self.proxies is not None:
+                    self.proxies.report(conn.proxy, time.monotonic() - started, status=resp.status)
+            except (OSError, http.client.HTTPException) as e:
+                if self.proxies is not None:
+                    self.proxies.report(getattr(e, 'proxy', None), ok=False)
+                if attempt >= self.retries:
+                    raise HttpError(url, reason=str(e))
+                self.sleep(self._delay(attempt))
+                attempt += 1
+                continue
+            if resp.status in REDIRECTS and redirects and resp.getheader('Location'):
+                resp.read()
+                self.release(*key, conn, not resp.will_close)
+                url = urljoin(url, resp.getheader('Location'))
+                redirects -= 1
+                continue
+            if resp.status in RETRY_STATUSES and attempt < self.retries:
+                delay = self._delay(attempt, resp)
+                resp.read()
+                self.release(*key, conn, not resp.will_close)
+                logging.info('HC - %s returned %d, retrying in %.1fs', url, resp.status, delay)
+                self.sleep(delay)
+                attempt += 1
+                continue
+            return StreamResponse(self, key, conn, resp, url)
+
+    def request(self, url: str, method: str='GET', headers: dict=None) -> Response:
+        '''Performs a request and reads the whole body'''
+        with self.open(url, method, headers) as resp:
+            body = resp.read()
+            return Response(resp.url, resp.status,
+                            {k.lower(): v for k, v in resp.headers.items()}, body)
+
+    def get(self, url: str, headers: dict=None) -> Response:
+        return self.request(url, 'GET', headers)
+
+    def close(self):
+        '''Close every idle connection'''
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except Empty:
+                    break
@@ -0,0 +1,160 @@
+"""Post-download validation and normalisation of images on a process pool.
+Each image is fully decoded; corrupt and under-resolution files are rejected and
+the rest are rewritten in one canonical format and colour mode, optionally with
+fixed-size square copies saved next to them as <name>_<size><ext>
+"""
+
+#stdlib
+import multiprocessing
+import os
+import re
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from threading import Lock
+
+FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+RESIZED_NAME = re.compile(r'_\d+$')
+
+
+def _save(img, path: str, fmt: str, quality: int):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.', suffix='.norm')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            img.save(out, fmt, quality=quality)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _canonical(img, mode: str):
+    from PIL import Image, ImageOps
+    if img.getexif().get(0x0112, 1) != 1:
+        img = ImageOps.exif_transpose(img)
+    if mode == 'RGB' and (img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info):
+        #Flatten transparency onto white rather than the black convert() would give
+        rgba = img.convert('RGBA')
+        flat = Image.new('RGB', rgba.size, (255, 255, 255))
+        flat.paste(rgba, mask=rgba.getchannel('A'))
+        return flat
+    return img if img.mode == mode else img.convert(mode)
+
+
+def normalize_image(path: str, min_side: int=64, fmt: str='JPEG', mode: str='RGB',
+                    quality: int=90, sizes: tuple=(), remove_rejected: bool=True) -> dict:
+    '''Validates one image and rewrites it as fmt in mode, under the same name
+    with fmt's extension. Returns a dict of source, path (None if rejected),
+    status (ok, too_small, corrupt or skipped), width, height, resized
+    (size -> path) and error. Symlinks (near-duplicates) are skipped'''
+    from PIL import Image, ImageOps
+    result = {'source': path, 'path': None, 'status': 'ok', 'width': None,
+              'height': None, 'resized': {}, 'error': None}
+    if os.path.islink(path):
+        result.update(status='skipped', path=path)
+        return result
+    stem, ext = os.path.splitext(path)[0], FORMATS[fmt]
+    try:
+        #verify() catches broken structure, load() truncated pixel data
+        with Image.open(path) as img:
+            img.verify()
+        with Image.open(path) as img:
+            img.load()
+            result.update(width=img.width, height=img.height)
+            if min(img.size) < min_side:
+                result['status'] = 'too_small'
+            else:
+                canonical = _canonical(img, mode)
+                out = stem + ext
+                if canonical is img and img.format == fmt:
+                    #Already canonical, so keep the original bytes
+                    if out != path:
+                        os.replace(path, out)
+                else:
+                    _save(canonical, out, fmt, quality)
+                    if out != path:
+                        os.remove(path)
+                result['path'] = out
+                for size in sizes:
+                    resized = '{}_{}{}'.format(stem, size, ext)
+                    _save(ImageOps.fit(canonical, (size, size), Image.LANCZOS), resized, fmt, quality)
+                    result['resized'][size] = resized
+    except Exception as e:
+        result.update(status='corrupt', error='{}: {}'.format(type(e).__name__, e))
+    if result['status'] != 'ok' and remove_rejected and os.path.exists(path):
+        os.remove(path)
+    return result
+
+
+def normalize_batch(paths: list, **options) -> list:
+    '''normalize_image over a list of paths, so one pool task covers many small images'''
+    return [normalize_image(path, **options) for path in paths]
+
+
+def iter_images(root: str) -> 'generator':
+    '''Yields the image files under root, skipping temp files and resized copies'''
+    for folder, _, files in os.walk(root):
+        for name in sorted(files):
+            stem, ext = os.path.splitext(name)
+            if name.startswith('.') or ext.lower() not in IMAGE_EXTENSIONS or RESIZED_NAME.search(stem):
+                continue
+            yield os.path.join(folder, name)
+
+
+class ImageNormalizer:
+    """Runs normalize_image with fixed options on a pool of worker processes,
+    one per core by default. counts tallies the statuses of finished images
+    """
+
+    def __init__(self, workers: int=None, chunksize: int=16, **options):
+        self.workers = workers or os.cpu_count()
+        self.chunksize = chunksize
+        self.options = options
+        self.counts = Counter()
+        self._lock = Lock()
+        #Workers come from a fork server, not a fork of the threaded crawler process
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else None)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+    def _tally(self, results: list):
+        with self._lock:
+            self.counts.update(result['status'] for result in results)
+
+    def submit(self, path: str) -> 'Future':
+        '''Normalises one image in the pool. The Future's result is normalize_image's dict'''
+        future = self.executor.submit(partial(normalize_image, **self.options), path)
+        future.add_done_callback(lambda f: f.exception() or self._tally([f.result()]))
+        return future
+
+    def batch(self, paths: 'iterable') -> 'generator':
+        '''Yields results for paths in order, with chunksize images per task and
+        at most two tasks per worker in flight, so paths can be a lazy iterable'''
+        pending, chunk = [], []
+        run = partial(normalize_batch, **self.options)
+
+        def drain(limit: int):
+            while len(pending) > limit:
+                results = pending.pop(0).result()
+                self._tally(results)
+                yield from results
+        for path in paths:
+            chunk.append(path)
+            if len(chunk) == self.chunksize:
+                pending.append(self.executor.submit(run, chunk))
+                chunk = []
+                yield from drain(self.workers * 2)
+        if chunk:
+            pending.append(self.executor.submit(run, chunk))
+        yield from drain(0)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,80 @@
+"""Lazy keyword sources and deterministic sharding of crawl jobs across nodes.
+Keywords are streamed from CSV (every cell is a keyword), JSONL (one object per
+line) or plain text (one keyword per line) without loading the whole list
+"""
+
+#stdlib
+import csv
+import hashlib
+import json
+
+
+def make_keyword(text: str) -> str:
+    '''Turns a keyword into the +-joined lowercase form used in search URLs'''
+    return text.strip().lower().replace(' ', '+')
+
+
+def parse_shard(spec: str) -> tuple:
+    '''Parses "index/count" (0-based index) into a tuple, e.g. "3/16" -> (3, 16)'''
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError('shard "{}" is not in index/count form'.format(spec))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError('shard index must be in 0..{}'.format(count - 1))
+    return index, count
+
+
+def shard_of(key: str, count: int) -> int:
+    '''Returns the shard a key belongs to. Stable across processes and machines'''
+    return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:16], 16) % count
+
+
+def read_keywords(path: str, field: str=None) -> 'generator':
+    '''Yields raw keywords from a .csv, .jsonl or text file, one at a time.
+    For JSONL the value of field is used, or the first of "keyword", "title"'''
+    with open(path, newline='') as src:
+        if path.endswith('.csv'):
+            for row in csv.reader(src, delimiter=','):
+                for cell in row:
+                    if cell.strip():
+                        yield cell
+        elif path.endswith('.jsonl'):
+            for line in src:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                fields = [field] if field else ['keyword', 'title']
+                for name in fields:
+                    if record.get(name):
+                        yield record[name]
+                        break
+        else:
+            for line in src:
+                if line.strip():
+                    yield line
+
+
+class JobSource:
+    """Streams (site, keyword, dataset) jobs for the keywords in one shard.
+    A keyword always lands in the same shard, so all sites for it are crawled
+    by the same node and share one output folder
+    """
+
+    def __init__(self, path: str, dataset: str, shard: tuple=(0, 1), field: str=None):
+        self.path = path
+        self.dataset = dataset
+        self.index, self.count = shard
+        self.field = field
+
+    def keywords(self) -> 'generator':
+        '''Yields this shard's normalised keywords, reading the file lazily'''
+        for raw in read_keywords(self.path, self.field):
+            keyword = make_keyword(raw)
+            if keyword and shard_of(self.dataset + '|' + keyword, self.count) == self.index:
+                yield keyword
+
+    def jobs(self, site: str) -> 'generator':
+        '''Yields the jobs for one site. Each call re-streams the file'''
+        for keyword in self.keywords():
+            yield (site, keyword, self.dataset)
@@ -0,0 +1,144 @@
+"""Provenance manifest: one row per image the crawler met, saying where it came
+from (site, keyword, page, rank, URL), what was stored (content hash, bytes,
+dimensions, location) and what happened to it (status). Rows are buffered and
+written in batches as part files under <root>/run=<run id>/, in JSONL or Parquet
+"""
+
+#stdlib
+import glob
+import json
+import os
+import secrets
+import tempfile
+import time
+from threading import Lock
+
+FIELDS = ('run', 'site', 'keyword', 'page', 'rank', 'url', 'sha1', 'bytes', 'width',
+          'height', 'path', 'status', 'error', 'time')
+
+
+def new_run_id() -> str:
+    '''A sortable id for a crawl run, e.g. 20240131T120000-4242-9f3a1c'''
+    return '{}-{}-{}'.format(time.strftime('%Y%m%dT%H%M%S'), os.getpid(), secrets.token_hex(3))
+
+
+class Manifest:
+    """Buffers rows and writes every batch rows as a new part file of this run's
+    partition. Parquet needs pyarrow, which is only imported when used
+    """
+
+    def __init__(self, root: str='manifest', run: str=None, batch: int=1000, fmt: str='jsonl'):
+        if fmt not in ('jsonl', 'parquet'):
+            raise ValueError('"{}" is not a manifest format'.format(fmt))
+        self.run = run or new_run_id()
+        self.batch = batch
+        self.fmt = fmt
+        self.folder = os.path.join(root, 'run=' + self.run)
+        self.rows = []
+        self.written = 0
+        #Continue after the parts of an earlier writer to the same run
+        self._parts = len(glob.glob(os.path.join(self.folder, 'part-*')))
+        self._lock = Lock()
+        self._write_lock = Lock()
+        os.makedirs(self.folder, exist_ok=True)
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+    def add(self, **fields):
+        '''Buffers one row. Unknown fields are dropped and missing ones left null'''
+        row = {name: fields.get(name) for name in FIELDS}
+        row['run'] = self.run
+        row['time'] = row['time'] or time.time()
+        with self._lock:
+            self.rows.append(row)
+            full = len(self.rows) >= self.batch
+        if full:
+            self.flush()
+
+    def _write(self, rows: list):
+        with self._write_lock:
+            fd, tmp = tempfile.mkstemp(dir=self.folder, prefix='.part-')
+            try:
+                if self.fmt == 'parquet':
+                    import pyarrow
+                    import pyarrow.parquet
+                    os.close(fd)
+                    pyarrow.parquet.write_table(pyarrow.Table.from_pylist(rows), tmp)
+                else:
+                    with os.fdopen(fd, 'w') as out:
+                        out.writelines(json.dumps(row) + '\n' for row in rows)
+                #Readers only ever see complete part files, and a link never
+                #replaces one written by another process under the same run id
+                while True:
+                    path = os.path.join(self.folder, 'part-{:05d}.{}'.format(self._parts, self.fmt))
+                    self._parts += 1
+                    try:
+                        os.link(tmp, path)
+                        break
+                    except FileExistsError:
+                        pass
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            self.written += len(rows)
+
+    def flush(self):
+        '''Writes the buffered rows as one part file'''
+        with self._lock:
+            rows, self.rows = self.rows, []
+        if rows:
+            self._write(rows)
+
+    def close(self):
+        self.flush()
+
+
+class ManifestReader:
+    """Query API over every run written under a manifest root
+    """
+
+    def __init__(self, root: str='manifest'):
+        self.root = root
+
+    def runs(self) -> list:
+        '''Returns the run ids, oldest first'''
+        return sorted(os.path.basename(folder)[len('run='):]
+                      for folder in glob.glob(os.path.join(self.root, 'run=*')))
+
+    def _parts(self, run: str=None) -> list:
+        pattern = os.path.join(self.root, 'run=' + (run or '*'), 'part-*')
+        return sorted(glob.glob(pattern))
+
+    def rows(self, run: str=None) -> 'generator':
+        '''Yields every row of one run, or of all runs'''
+        for path in self._parts(run):
+            if path.endswith('.parquet'):
+                import pyarrow.parquet
+                yield from pyarrow.parquet.read_table(path).to_pylist()
+            else:
+                with open(path) as src:
+                    for line in src:
+                        yield json.loads(line)
+
+    def query(self, run: str=None, fields: 'iterable'=None, where: 'callable'=None,
+                **equals) -> 'generator':
+        '''Yields rows whose fields equal the keyword arguments (a list or set
+        matches any of its values) and for which where(row) is true, reduced to
+        fields if given. e.g. query(site='bing', status='saved', fields=['path'])'''
+        for row in self.rows(run):
+            if any(row.get(name) not in value if isinstance(value, (list, set, tuple))
+                   else row.get(name) != value for name, value in equals.items()):
+                continue
+            if where is not None and not where(row):
+                continue
+            yield {name: row.get(name) for name in fields} if fields else row
+
+    def count(self, run: str=None, by: str='status', **equals) -> dict:
+        '''Counts matching rows per value of the by field'''
+        counts = {}
+        for row in self.query(run, **equals):
+            counts[row.get(by)] = counts.get(row.get(by), 0) + 1
+        return counts
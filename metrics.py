@@ -0,0 +1,203 @@
+"""Crawl metrics: labelled counters, histograms and sampled gauges, exported as
+Prometheus text over HTTP, as JSONL snapshots and as a periodic summary line
+"""
+
+#stdlib
+import json
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+
+BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None)))
+
+
+def _labels(pairs: tuple, extra: str='') -> str:
+    parts = ['{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Histogram:
+    """Cumulative bucket counts plus count and sum, as in Prometheus"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value: float):
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        '''Upper bound of the bucket holding the q-th quantile'''
+        if not self.count:
+            return 0.
+        rank, seen = q * self.count, 0
+        for bound, hits in zip(BUCKETS + (float('inf'),), self.buckets):
+            seen += hits
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """Thread-safe registry. Labels are keyword arguments, e.g. site='bing'
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def inc(self, name: str, value: float=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def gauge(self, name: str, sample: 'callable', **labels):
+        '''Registers a callable that is sampled whenever metrics are exported'''
+        with self._lock:
+            self.gauges[_key(name, labels)] = sample
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> 'generator-with':
+        '''Observes the duration of the block in seconds'''
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def total(self, name: str, **labels) -> float:
+        '''Sum of a counter over every label set that includes the given labels'''
+        wanted = set(_key(name, labels)[1])
+        with self._lock:
+            return sum(v for (n, l), v in self.counters.items()
+                       if n == name and wanted.issubset(l))
+
+    def merged(self, name: str) -> Histogram:
+        '''One histogram summing every label set of name'''
+        merged = Histogram()
+        with self._lock:
+            for (n, _), hist in self.histograms.items():
+                if n == name:
+                    merged.buckets = [a + b for a, b in zip(merged.buckets, hist.buckets)]
+                    merged.count += hist.count
+                    merged.sum += hist.sum
+        return merged
+
+    def _sampled(self) -> dict:
+        with self._lock:
+            gauges = list(self.gauges.items())
+        values = {}
+        for key, sample in gauges:
+            try:
+                values[key] = sample()
+            except Exception as e:
+                logging.warning('MX - gauge %s failed: %s', key[0], e)
+        return values
+
+    def snapshot(self) -> dict:
+        '''Returns every metric as plain JSON-able data'''
+        gauges = self._sampled()
+        with self._lock:
+            return {
+                'time': time.time(),
+                'counters': [{'name': n, 'labels': dict(l), 'value': v}
+                             for (n, l), v in self.counters.items()],
+                'histograms': [{'name': n, 'labels': dict(l), 'count': h.count, 'sum': h.sum,
+                                'buckets': h.buckets} for (n, l), h in self.histograms.items()],
+                'gauges': [{'name': n, 'labels': dict(l), 'value': v}
+                           for (n, l), v in gauges.items()],
+            }
+
+    def prometheus(self) -> str:
+        '''Returns every metric in the Prometheus text exposition format'''
+        gauges = self._sampled()
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append('{}{} {}'.format(name, _labels(labels), value))
+            for (name, labels), hist in sorted(self.histograms.items(), key=lambda item: item[0]):
+                seen = 0
+                for bound, hits in zip(BUCKETS + ('+Inf',), hist.buckets):
+                    seen += hits
+                    lines.append('{}_bucket{} {}'.format(name, _labels(labels, 'le="{}"'.format(bound)), seen))
+                lines.append('{}_count{} {}'.format(name, _labels(labels), hist.count))
+                lines.append('{}_sum{} {}'.format(name, _labels(labels), hist.sum))
+        for (name, labels), value in sorted(gauges.items()):
+            lines.append('{}{} {}'.format(name, _labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsReporter:
+    """Logs a summary line and appends a JSONL snapshot every interval seconds,
+    and optionally serves /metrics in Prometheus format on a local port
+    """
+
+    def __init__(self, metrics: Metrics, interval: float=30, jsonl_path: str=None,
+                    port: int=None, summary: 'callable'=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.jsonl_path = jsonl_path
+        self.summary = summary
+        self._stop = Event()
+        self._thread = Thread(target=self._loop, daemon=True)
+        self.server = None
+        if port is not None:
+            self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+            Thread(target=self.server.serve_forever, daemon=True).start()
+        self._thread.start()
+
+    def _handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *_):
+                pass
+        return Handler
+
+    def report(self):
+        '''Emit one summary line and JSONL snapshot now'''
+        if self.summary is not None:
+            logging.info('MX - %s', self.summary())
+        if self.jsonl_path:
+            with open(self.jsonl_path, 'a') as out:
+                out.write(json.dumps(self.metrics.snapshot()) + '\n')
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.report()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
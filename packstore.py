@@ -0,0 +1,211 @@
+"""Output backends for persisted images. FileStore keeps the one-file-per-image
+layout; PackStore appends images to rolling WebDataset-style tar shards with an
+offset index beside each, which ShardReader/PackReader memory-map for lookups.
+Pack locations have the form "<shard>.tar#<member>"
+"""
+
+#stdlib
+import glob
+import io
+import mmap
+import os
+import tarfile
+import time
+from threading import Lock
+
+BUFFER_SIZE = 1024 * 1024
+SHARD_BYTES = 1024 ** 3
+
+
+class FileStore:
+    """Moves each temp file to its own path, the crawler's original layout.
+    near_dups, if given, symlinks or drops near-duplicates after the move
+    """
+
+    def __init__(self, near_dups: 'NearDupIndex'=None):
+        self.near_dups = near_dups
+        #Temp files are written next to their final path
+        self.staging = None
+
+    def save(self, tmp: str, filepath: str, resized: dict=None) -> tuple:
+        '''Stores tmp at filepath and resized copies beside it as <name>_<size><ext>.
+        Returns (location, near-duplicate original or None)'''
+        os.replace(tmp, filepath)
+        original = self.near_dups.process(filepath) if self.near_dups is not None else None
+        stem, ext = os.path.splitext(filepath)
+        for size, path in (resized or {}).items():
+            #A near-duplicate's copies would be orphans next to a symlink or nothing
+            if original:
+                os.remove(path)
+            else:
+                os.replace(path, '{}_{}{}'.format(stem, size, ext))
+        return filepath, original
+
+    def close(self):
+        pass
+
+
+class PackStore:
+    """Appends images to tar shards under root named <prefix>-000000.tar, rolling
+    to a new shard once one reaches shard_bytes. Members are named <key><ext>,
+    where key is the image path relative to base without its extension, and
+    resized copies <key>.<size><ext> so WebDataset groups them with the image.
+    Each shard's <shard>.idx lists member, data offset and size per line.
+    Images are downloaded into root/.staging before they are appended.
+    A near-duplicate is not written; its location is the original's
+    """
+
+    def __init__(self, root: str='shards', shard_bytes: int=SHARD_BYTES, prefix: str='images',
+                    base: str='.', near_dups: 'NearDupIndex'=None):
+        self.root = root
+        self.shard_bytes = shard_bytes
+        self.prefix = prefix
+        self.base = os.path.abspath(base)
+        self.near_dups = near_dups
+        self._lock = Lock()
+        self._tar = self._file = self._idx = None
+        os.makedirs(root, exist_ok=True)
+        #Downloads are streamed here rather than into per-keyword folders that packed output never uses
+        self.staging = os.path.join(root, '.staging')
+        #Where to start looking for a free shard number; _open never reuses an existing shard
+        self.shard = len(glob.glob(os.path.join(root, prefix + '-*.tar')))
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+    def key(self, filepath: str) -> str:
+        return os.path.relpath(os.path.splitext(os.path.abspath(filepath))[0], self.base).replace(os.sep, '/')
+
+    def _open(self):
+        #Created exclusively, so processes sharing a root each get shards of their own
+        while True:
+            path = os.path.join(self.root, '{}-{:06d}.tar'.format(self.prefix, self.shard))
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                break
+            except FileExistsError:
+                self.shard += 1
+        self.name = os.path.basename(path)
+        self._file = os.fdopen(fd, 'wb', buffering=BUFFER_SIZE)
+        self._tar = tarfile.open(fileobj=self._file, mode='w', format=tarfile.PAX_FORMAT)
+        self._idx = open(path[:-len('.tar')] + '.idx', 'w', buffering=BUFFER_SIZE)
+
+    def _roll(self):
+        self._tar.close()
+        self._file.close()
+        self._idx.close()
+        self._tar = self._file = self._idx = None
+        self.shard += 1
+
+    def _append(self, member: str, data: bytes) -> str:
+        if self._tar is None:
+            self._open()
+        info = tarfile.TarInfo(member)
+        info.size = len(data)
+        info.mtime = time.time()
+        info.mode = 0o644
+        offset = self._tar.offset + len(info.tobuf(self._tar.format, self._tar.encoding, self._tar.errors))
+        self._tar.addfile(info, io.BytesIO(data))
+        self._idx.write('{}\t{}\t{}\n'.format(member, offset, len(data)))
+        return '{}#{}'.format(self.name, member)
+
+    def save(self, tmp: str, filepath: str, resized: dict=None) -> tuple:
+        '''Appends tmp (and resized copies) to the current shard and removes the
+        temp files. Returns (location, near-duplicate original or None)'''
+        key = self.key(filepath)
+        ext = os.path.splitext(filepath)[1]
+        with open(tmp, 'rb') as src:
+            data = src.read()
+        original = None
+        if self.near_dups is not None:
+            original = self.near_dups.match('{}{}'.format(key, ext), data)
+        with self._lock:
+            if original is None:
+                location = self._append(key + ext, data)
+                for size, path in (resized or {}).items():
+                    with open(path, 'rb') as src:
+                        self._append('{}.{}{}'.format(key, size, ext), src.read())
+                if self._tar.offset >= self.shard_bytes:
+                    self._roll()
+            else:
+                location = original
+        for path in [tmp] + list((resized or {}).values()):
+            os.remove(path)
+        return location, original
+
+    def close(self):
+        with self._lock:
+            if self._tar is not None:
+                self._roll()
+
+
+class ShardReader:
+    """Random access to one finished shard by member name through mmap
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets = {}
+        with open(path[:-len('.tar')] + '.idx') as idx:
+            for line in idx:
+                member, offset, size = line.rstrip('\n').rsplit('\t', 2)
+                self.offsets[member] = (int(offset), int(size))
+        self._file = open(path, 'rb')
+        self.map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+    def __contains__(self, member: str) -> bool:
+        return member in self.offsets
+
+    def get(self, member: str) -> bytes:
+        offset, size = self.offsets[member]
+        return self.map[offset:offset + size]
+
+    def close(self):
+        self.map.close()
+        self._file.close()
+
+
+class PackReader:
+    """Looks images up across every shard in a PackStore root, by member name
+    (<key><ext>) or by the "<shard>#<member>" location the store returned
+    """
+
+    def __init__(self, root: str='shards', prefix: str='images'):
+        self.shards = {}
+        self.members = {}
+        for path in sorted(glob.glob(os.path.join(root, prefix + '-*.tar'))):
+            if not os.path.exists(path[:-len('.tar')] + '.idx') or not os.path.getsize(path):
+                continue
+            shard = ShardReader(path)
+            self.shards[os.path.basename(path)] = shard
+            for member in shard.offsets:
+                self.members[member] = shard
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+    def __len__(self):
+        return len(self.members)
+
+    def keys(self) -> list:
+        return list(self.members)
+
+    def get(self, name: str) -> bytes:
+        '''Returns an image's bytes. Raises KeyError if it is in no finished shard'''
+        if '#' in name:
+            shard, member = name.split('#', 1)
+            return self.shards[shard].get(member)
+        return self.members[name].get(name)
+
+    def close(self):
+        for shard in self.shards.values():
+            shard.close()
@@ -0,0 +1,119 @@
+"""Perceptual-hash near-duplicate detection for downloaded images.
+dHashes are kept in a BK-tree so lookups stay well below pairwise comparison
+"""
+
+#stdlib
+import io
+import logging
+import os
+from threading import Lock
+
+
+def dhash(data: bytes, size: int=8) -> int:
+    '''Returns the size*size bit difference hash of an encoded image'''
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as img:
+        pixels = list(img.convert('L').resize((size + 1, size)).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            value = (value << 1) | (left > pixels[row * (size + 1) + col + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Metric tree over Hamming distance for radius queries on hashes
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value: int, item):
+        '''Insert a hash and its payload'''
+        self.size += 1
+        if self.root is None:
+            self.root = (value, item, {})
+            return
+        node = self.root
+        while True:
+            dist = hamming(value, node[0])
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = (value, item, {})
+                return
+            node = child
+
+    def find(self, value: int, radius: int) -> list:
+        '''Returns (distance, hash, item) for everything within radius, nearest first'''
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            dist = hamming(value, node[0])
+            if dist <= radius:
+                found.append((dist, node[0], node[1]))
+            for edge, child in node[2].items():
+                if dist - radius <= edge <= dist + radius:
+                    stack.append(child)
+        return sorted(found, key=lambda match: match[0])
+
+
+class NearDupIndex:
+    """Finds near-duplicates of newly saved images across keywords and sites and
+    either deletes them ('drop') or replaces them with a symlink ('symlink')
+    """
+
+    def __init__(self, max_distance: int=6, action: str='symlink', index: 'DedupIndex'=None):
+        if action not in ('drop', 'symlink'):
+            raise ValueError('"{}" is not a valid near-duplicate action'.format(action))
+        self.max_distance = max_distance
+        self.action = action
+        self.index = index
+        self.tree = BKTree()
+        self._lock = Lock()
+        if index is not None:
+            for value, path in index.phashes():
+                self.tree.add(value, path)
+
+    def match(self, item: str, data: bytes) -> str:
+        '''Hashes an image stored as item (a path or pack location). Returns the
+        item it nearly duplicates, or registers it and returns None'''
+        try:
+            value = dhash(data)
+        except Exception as e:
+            logging.warning('ND - Could not hash %s: %s', item, e)
+            return None
+        with self._lock:
+            matches = self.tree.find(value, self.max_distance)
+            if not matches:
+                self.tree.add(value, str(item))
+                if self.index is not None:
+                    self.index.add_phash(value, item)
+                return None
+        return matches[0][2]
+
+    def process(self, path: str, data: bytes=None) -> str:
+        '''Hashes a saved image. Returns the original path if it was a near-duplicate'''
+        if data is None:
+            try:
+                with open(path, 'rb') as src:
+                    data = src.read()
+            except OSError as e:
+                logging.warning('ND - Could not hash %s: %s', path, e)
+                return None
+        original = self.match(path, data)
+        if original is None or os.path.abspath(original) == os.path.abspath(path):
+            return None
+        os.remove(path)
+        if self.action == 'symlink':
+            os.symlink(os.path.abspath(original), path)
+        return original
@@ -0,0 +1,208 @@
+"""Producer/consumer pipeline that decouples page navigation from image fetching.
+The browser thread only puts (url, filepath) pairs on a bounded queue; download
+workers stream each body into a temp file and a persist worker moves it into place.
+With a Metrics registry it records download latency, bytes, outcomes and queue depths.
+With an ImageNormalizer each temp file is validated and re-encoded before it is persisted.
+Where finished images go is up to the store: a FileStore (the default) or a PackStore.
+With a Manifest every URL put() gets a provenance row saying what became of it
+"""
+
+#stdlib
+import logging
+import os
+import time
+from collections import Counter
+from queue import Queue
+from threading import Thread, Lock
+#module
+from downloader import HostLimiter, stream_to_temp, final_path, image_dimensions, MAX_BYTES
+from packstore import FileStore
+from httpclient import HttpClient, HttpError
+
+_STOP = object()
+
+
+class ImagePipeline:
+    """Bounded fetch -> persist pipeline. put() blocks when the queues are full
+    so memory stays flat no matter how far ahead the browser gets
+    """
+
+    def __init__(self, download_workers: int=8, per_host: int=4,
+                    max_queued: int=256, max_unwritten: int=64, timeout: int=30,
+                    index: 'DedupIndex'=None, near_dups: 'NearDupIndex'=None,
+                    max_bytes: int=MAX_BYTES, client: HttpClient=None,
+                    metrics: 'Metrics'=None, normalizer: 'ImageNormalizer'=None,
+                    store: 'FileStore'=None, manifest: 'Manifest'=None):
+        self.client = client or HttpClient(max_per_host=per_host, timeout=timeout)
+        self.max_bytes = max_bytes
+        self.saved = 0
+        self.failures = Counter()
+        self.index = index
+        #near_dups goes to the default FileStore; a given store brings its own
+        self.store = store or FileStore(near_dups)
+        self.metrics = metrics
+        self.normalizer = normalizer
+        self.manifest = manifest
+        self._inflight = {}
+        self._lock = Lock()
+        self.hosts = HostLimiter(per_host)
+        self.url_queue = Queue(maxsize=max_queued)
+        self.write_queue = Queue(maxsize=max_unwritten)
+        self.downloaders = [Thread(target=self._download_stage, daemon=True)
+                            for _ in range(download_workers)]
+        self.writer = Thread(target=self._persist_stage, daemon=True)
+        if metrics is not None:
+            metrics.gauge('pipeline_queue_depth', self.url_queue.qsize, queue='download')
+            metrics.gauge('pipeline_queue_depth', self.write_queue.qsize, queue='persist')
+            metrics.gauge('pipeline_inflight', lambda: len(self._inflight))
+        for thread in self.downloaders + [self.writer]:
+            thread.start()
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+    def put(self, url: str, filepath: str, labels: dict=None, meta: dict=None):
+        '''Queue a URL to be saved at filepath. Blocks while the pipeline is full.
+        URLs already in the dedup index, saved or rejected, are dropped without a request.
+        labels (e.g. site and keyword) tag the metrics and manifest row for the URL,
+        meta (e.g. page and rank) only its manifest row'''
+        labels = labels or {}
+        meta = dict(meta or {}, url=url)
+        if self.index is not None and self.index.seen_url(url):
+            self._count('seen', labels, meta)
+            return
+        with self._lock:
+            self._inflight[url] = str(filepath)
+        self.url_queue.put((url, str(filepath), labels, meta))
+
+    def pending(self) -> list:
+        '''Returns the (url, filepath) pairs queued but not yet persisted'''
+        with self._lock:
+            return list(self._inflight.items())
+
+    def _count(self, status: str, labels: dict, meta: dict, **fields):
+        if self.metrics is not None:
+            self.metrics.inc('images_total', status=status, **labels)
+        if self.manifest is not None:
+            self.manifest.add(status=status, **dict(meta, **labels, **fields))
+
+    def _fail(self, error: Exception, labels: dict, meta: dict):
+        reason = type(error).__name__
+        if isinstance(error, HttpError) and error.status:
+            reason += ' ' + str(error.status)
+        with self._lock:
+            self.failures[reason] += 1
+        self._count('failed', labels, meta, error='{}: {}'.format(type(error).__name__, error))
+
+    def _reject(self, url: str, tmp: str, result: dict, labels: dict, meta: dict):
+        logging.warning('PL - %s rejected: %s', url, result['error'] or result['status'])
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        with self._lock:
+            self.failures[result['status']] += 1
+        if self.index is not None:
+            #So put() skips it next time without downloading and decoding it again
+            self.index.add_rejected(url, meta.get('sha1'), result['status'])
+        self._count('rejected', labels, meta, error=result['error'] or result['status'],
+                    width=result['width'], height=result['height'])
+        self._finish(url)
+
+    def _discard(self, paths: list):
+        for path in paths:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    def _finish(self, url: str):
+        with self._lock:
+            self._inflight.pop(url, None)
+
+    def fetch(self, url: str, folder: str) -> tuple:
+        '''Streams a URL into a temp file in folder. Returns (temp_path, extension, sha1, size)'''
+        with self.client.open(url) as resp:
+            if not 200 <= resp.status < 300:
+                raise HttpError(url, resp.status)
+            return stream_to_temp(resp, folder, self.max_bytes)
+
+    def _download_stage(self):
+        while True:
+            item = self.url_queue.get()
+            if item is _STOP:
+                break
+            url, filepath, labels, meta = item
+            tmp, resized = None, {}
+            try:
+                with self.hosts.slot(url):
+                    started = time.perf_counter()
+                    tmp, ext, sha1, size = self.fetch(url, self.store.staging or os.path.dirname(filepath))
+                meta = dict(meta, sha1=sha1, bytes=size)
+                if self.metrics is not None:
+                    #Histograms are per site only; per keyword they would be too many series
+                    self.metrics.observe('download_seconds', time.perf_counter() - started,
+                                         site=labels.get('site'))
+                    self.metrics.inc('download_bytes_total', size, **labels)
+                if self.normalizer is not None:
+                    #Decoding runs in the normalizer's processes; this thread only waits
+                    result = self.normalizer.submit(tmp).result()
+                    if result['path'] is None:
+                        self._reject(url, tmp, result, labels, meta)
+                        continue
+                    tmp, resized = result['path'], result['resized']
+                    ext = os.path.splitext(tmp)[1]
+                if self.manifest is not None:
+                    with open(tmp, 'rb') as src:
+                        width, height = image_dimensions(src.read(64 * 1024))
+                    meta.update(width=width, height=height)
+                self.write_queue.put((url, final_path(filepath, ext), tmp, sha1, labels, resized, meta))
+            except Exception as e:
+                logging.warning('PL - %s %s', url, e)
+                self._fail(e, labels, meta)
+                #e.g. a broken normalizer pool; don't leave hidden temp files in the dataset
+                self._discard([tmp] + list(resized.values()))
+                self._finish(url)
+
+    def _persist_stage(self):
+        while True:
+            item = self.write_queue.get()
+            if item is _STOP:
+                break
+            url, filepath, tmp, sha1, labels, resized, meta = item
+            try:
+                known = self.index.content_path(sha1) if self.index is not None else None
+                if known:
+                    #Same image reached through another URL
+                    for path in [tmp] + list(resized.values()):
+                        os.remove(path)
+                    self.index.add(url, sha1, known)
+                    self._count('duplicate', labels, meta, path=known)
+                    continue
+                #Only complete files ever appear under their final name or in a shard
+                location, original = self.store.save(tmp, filepath, resized)
+                self.saved += 1
+                if self.index is not None:
+                    #A dropped near-duplicate has no file of its own; point at what it duplicates
+                    self.index.add(url, sha1, original or location)
+                if original:
+                    self._count('near_duplicate', labels, meta, path=original)
+                else:
+                    self._count('saved', labels, meta, path=location)
+            except Exception as e:
+                #e.g. sqlite3 "database is locked"; the writer must outlive it or put() blocks
+                logging.warning('PL - %s %s', filepath, e)
+                self._fail(e, labels, meta)
+                self._discard([tmp] + list(resized.values()))
+            finally:
+                self._finish(url)
+
+    def close(self):
+        '''Drain both stages and stop the worker threads'''
+        for _ in self.downloaders:
+            self.url_queue.put(_STOP)
+        for thread in self.downloaders:
+            thread.join()
+        self.write_queue.put(_STOP)
+        self.writer.join()
+        self.store.close()
+        if self.manifest is not None:
+            self.manifest.flush()
@@ -0,0 +1,117 @@
+"""Pool of proxies (in the WebPage proxy dict format) ranked by measured health.
+Drivers and download connections are given the healthiest proxy, and proxies that
+turn slow, error-prone or blocked are benched for a cool-down period
+"""
+
+#stdlib
+import time
+from threading import Lock
+
+BLOCKED_STATUSES = (403, 407, 429)
+
+
+def proxy_id(proxy: dict) -> str:
+    '''Returns "host:port" for a proxy dict, without any credentials'''
+    return '{}:{}'.format(proxy['ip'].split('@')[-1], proxy['port'])
+
+
+class ProxyHealth:
+    """Exponentially weighted latency and error rate of one proxy"""
+
+    def __init__(self, proxy: dict, latency: float):
+        self.proxy = proxy
+        self.latency = latency
+        self.error_rate = 0.
+        self.samples = 0
+        self.in_use = 0
+        self.benched_until = 0.
+
+
+class ProxyPool:
+    """Tracks every proxy's latency and error rate from report() calls.
+    acquire()/release() lease a proxy to a long-lived user such as a driver;
+    pick() just returns the current best one for a short-lived connection
+    """
+
+    def __init__(self, proxies: list, alpha: float=.2, max_latency: float=10.,
+                    max_error_rate: float=.5, min_samples: int=5, cooldown: float=300.,
+                    clock: 'callable'=time.monotonic):
+        self.alpha = alpha
+        self.max_latency = max_latency
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self.clock = clock
+        self._lock = Lock()
+        #Unmeasured proxies start at half the latency limit so they get tried
+        self._health = {proxy_id(p): ProxyHealth(p, max_latency / 2) for p in proxies}
+
+    def __len__(self):
+        return len(self._health)
+
+    def _score(self, health: ProxyHealth) -> float:
+        return health.latency * (1 + 4 * health.error_rate) * (1 + health.in_use)
+
+    def _best(self) -> ProxyHealth:
+        now = self.clock()
+        ready = [h for h in self._health.values() if h.benched_until <= now]
+        if not ready:
+            #Everything is benched: fall back to whichever comes back first
+            ready = [min(self._health.values(), key=lambda h: h.benched_until)]
+        return min(ready, key=self._score)
+
+    def pick(self) -> dict:
+        '''Returns the healthiest proxy, or None if the pool is empty'''
+        with self._lock:
+            return self._best().proxy if self._health else None
+
+    def acquire(self) -> dict:
+        '''Leases the healthiest proxy. Pair with release()'''
+        with self._lock:
+            if not self._health:
+                return None
+            health = self._best()
+            health.in_use += 1
+            return health.proxy
+
+    def release(self, proxy: dict):
+        with self._lock:
+            health = self._health.get(proxy_id(proxy)) if proxy else None
+            if health and health.in_use:
+                health.in_use -= 1
+
+    def report(self, proxy: dict, latency: float=None, ok: bool=True, status: int=None):
+        '''Records the outcome of a request made through a proxy'''
+        if not proxy:
+            return
+        with self._lock:
+            health = self._health.get(proxy_id(proxy))
+            if health is None:
+                return
+            health.samples += 1
+            if latency is not None:
+                health.latency += self.alpha * (latency - health.latency)
+            failed = not ok or status in BLOCKED_STATUSES
+            health.error_rate += self.alpha * (float(failed) - health.error_rate)
+            if status in BLOCKED_STATUSES or not self._healthy(health):
+                health.benched_until = self.clock() + self.cooldown
+
+    def _healthy(self, health: ProxyHealth) -> bool:
+        if health.benched_until > self.clock():
+            return False
+        if health.samples < self.min_samples:
+            return True
+        return health.latency <= self.max_latency and health.error_rate <= self.max_error_rate
+
+    def healthy(self, proxy: dict) -> bool:
+        '''False once a proxy is benched or its measurements exceed the limits'''
+        if not proxy:
+            return True
+        with self._lock:
+            health = self._health.get(proxy_id(proxy))
+            return health is None or self._healthy(health)
+
+    def any_healthy(self) -> bool:
+        '''True if some proxy is neither benched nor over the limits'''
+        with self._lock:
+            return any(self._healthy(health) for health in self._health.values())
@@ -0,0 +1,132 @@
+"""Per-host token-bucket rate limiting and a scheduler that interleaves crawl jobs
+across sites so each host is kept just under its limit
+"""
+
+#stdlib
+import time
+from threading import Condition, Lock
+from urllib.parse import urlsplit
+
+
+def host_key(url: str) -> str:
+    '''Returns the host of a URL, or the value itself if it is already a host'''
+    return (urlsplit(url).netloc or url).lower()
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most burst. Tokens may go negative:
+    each caller reserves a token and is told how long to wait for it
+    """
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        '''Takes a token and returns the seconds to wait before using it'''
+        self._refill(now)
+        self.tokens -= 1
+        return 0. if self.tokens >= 0 else -self.tokens / self.rate
+
+    def delay(self, now: float) -> float:
+        '''Returns the seconds until a token would be available, without taking one'''
+        self._refill(now)
+        return 0. if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class HostRateLimiter:
+    """Keeps a TokenBucket per host. limits maps a host to (rate, burst); every
+    other host gets the defaults. clock and sleep can be faked in tests
+    """
+
+    def __init__(self, rate: float=2, burst: float=4, limits: dict=None,
+                    clock: 'callable'=time.monotonic, sleep: 'callable'=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.limits = {host_key(host): limit for host, limit in (limits or {}).items()}
+        self.clock = clock
+        self.sleep = sleep
+        self._buckets = {}
+        self._lock = Lock()
+
+    def _bucket(self, host: str) -> TokenBucket:
+        if host not in self._buckets:
+            rate, burst = self.limits.get(host, (self.rate, self.burst))
+            self._buckets[host] = TokenBucket(rate, burst, self.clock())
+        return self._buckets[host]
+
+    def set_limit(self, url: str, rate: float, burst: float):
+        '''Changes the limit for a host'''
+        host = host_key(url)
+        with self._lock:
+            self.limits[host] = (rate, burst)
+            self._buckets.pop(host, None)
+
+    def acquire(self, url: str) -> float:
+        '''Blocks until the URL's host may be hit again. Returns the time waited'''
+        with self._lock:
+            wait = self._bucket(host_key(url)).reserve(self.clock())
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    def delay(self, url: str) -> float:
+        '''Returns how long a request to the URL's host would wait right now'''
+        with self._lock:
+            return self._bucket(host_key(url)).delay(self.clock())
+
+
+class PolitenessScheduler:
+    """Iterates over per-site job streams, always handing out a job for the site
+    whose host can be hit soonest, round-robin among sites that are equally ready.
+    sites maps a site name to (host or url, iterable of jobs[, concurrency]).
+    A site with a concurrency limit gets no new job until done(name) is called
+    for one of its outstanding jobs
+    """
+
+    def __init__(self, sites: dict, limiter: HostRateLimiter):
+        self.limiter = limiter
+        self.sites = []
+        self.limits = {}
+        for name, spec in sites.items():
+            self.sites.append((name, spec[0], iter(spec[1])))
+            self.limits[name] = spec[2] if len(spec) > 2 else None
+        self.running = dict.fromkeys(self.limits, 0)
+        self._cond = Condition()
+
+    def done(self, name: str):
+        '''Marks one job of a site as finished'''
+        with self._cond:
+            self.running[name] -= 1
+            self._cond.notify_all()
+
+    def _free(self, index: int) -> bool:
+        name = self.sites[index][0]
+        return self.limits[name] is None or self.running[name] < self.limits[name]
+
+    def __iter__(self):
+        turn = 0
+        while self.sites:
+            with self._cond:
+                count = len(self.sites)
+                order = [i for i in ((turn + i) % count for i in range(count)) if self._free(i)]
+                if not order:
+                    self._cond.wait()
+                    continue
+            pick = min(order, key=lambda i: self.limiter.delay(self.sites[i][1]))
+            name = self.sites[pick][0]
+            try:
+                job = next(self.sites[pick][2])
+            except StopIteration:
+                del self.sites[pick]
+                continue
+            with self._cond:
+                self.running[name] += 1
+            turn = pick + 1
+            yield job
@@ -0,0 +1,51 @@
+"""Infinite-scroll loader that streams newly appeared result URLs as a page grows
+"""
+
+#stdlib
+import logging
+#module
+from waits import result_count_above, COUNT_JS
+
+SCROLL_JS = 'window.scrollTo(0, document.body.scrollHeight);'
+
+
+class ScrollLoader:
+    """Scrolls a WebPage until target results are loaded or the count stops growing.
+    Only the elements added since the previous scroll are read back each time.
+    With capture, URLs come from the page's network log instead of the DOM and
+    the XPath is only used to notice that more results arrived
+    """
+
+    def __init__(self, page: 'WebPage', xpath: str, target: int=1000,
+                    growth_timeout: float=5, attr: str='src', capture: bool=False):
+        self.page = page
+        self.xpath = xpath
+        self.target = target
+        self.growth_timeout = growth_timeout
+        self.attr = attr
+        self.capture = capture
+        self.scrolls = 0
+
+    def stream(self) -> 'generator':
+        '''Yields lists of new URLs, one list per scroll'''
+        count = 0
+        while count < self.target:
+            if self.capture:
+                count = self.page.driver.execute_script(COUNT_JS, self.xpath)
+                urls = [image['url'] for image in self.page.network_images()]
+            else:
+                rows = self.page.extract(self.xpath, [self.attr], start=count)
+                count += len(rows)
+                urls = [row[self.attr] for row in rows
+                        if row[self.attr] and row[self.attr].startswith('http')]
+            if urls:
+                yield urls
+            if count >= self.target:
+                break
+            self.page.driver.execute_script(SCROLL_JS)
+            self.scrolls += 1
+            if not self.page.wait(result_count_above(self.xpath, count),
+                                  timeout=self.growth_timeout):
+                logging.info('SL - Results stopped growing at %d after %d scrolls',
+                             count, self.scrolls)
+                break
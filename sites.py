@@ -0,0 +1,101 @@
+"""Site adapters: everything the crawler needs to know about one image source.
+Adding a source means subclassing SiteAdapter and decorating it with @register
+"""
+
+#module
+from staticengine import StaticEngine
+
+SITES = {}
+
+
+def register(cls):
+    '''Class decorator that adds an adapter instance to the SITES registry'''
+    SITES[cls.name] = cls()
+    return cls
+
+
+def get_site(name: str) -> 'SiteAdapter':
+    try:
+        return SITES[name]
+    except KeyError:
+        raise KeyError('"{}" is not a registered site'.format(name))
+
+
+class SiteAdapter:
+    """Search URL, result extraction and pagination for one source, plus the
+    settings the scheduler uses for it: concurrency (jobs in flight at once, None
+    leaves browser sites bound only by the driver pool),
+    rate (requests per second, burst) and max_pages (pagination depth)
+    """
+    name = None
+    search_url = None
+    img_xpath = None
+    next_xpath = None
+    requires_js = True
+    infinite_scroll = False
+    concurrency = None
+    rate = (2, 4)
+    max_pages = 4
+
+    def search_url_for(self, keyword: str) -> str:
+        '''Returns the first result page URL for an already +-joined keyword'''
+        return self.search_url + keyword
+
+    def extract(self, html: str, base_url: str) -> list:
+        '''Returns the image URLs in a result page's HTML'''
+        return [url for url in StaticEngine.parse(html, base_url, self.img_xpath, 'src')
+                if url.startswith('http')]
+
+    def next_page_url(self, html: str, base_url: str) -> str:
+        '''Returns the next result page URL from a page's HTML, or None'''
+        if not self.next_xpath:
+            return None
+        links = StaticEngine.parse(html, base_url, self.next_xpath, 'href')
+        return links[0] if links else None
+
+    def extract_page(self, page: 'WebPage') -> list:
+        '''Returns the image URLs on the page a driver has loaded'''
+        #Lazy-loaded thumbnails carry data: placeholders until they scroll into view
+        return [row['src'] for row in page.extract(self.img_xpath, ['src'])
+                if row['src'] and row['src'].startswith('http')]
+
+    def next_page(self, page: 'WebPage', navigate: 'callable') -> bool:
+        '''Moves a driver to the next result page using navigate(page, url).
+        Returns False when there is no next page'''
+        links = page.extract(self.next_xpath, ['href']) if self.next_xpath else []
+        if not links or not links[0]['href']:
+            return False
+        navigate(page, links[0]['href'])
+        return True
+
+
+@register
+class GettyImages(SiteAdapter):
+    name = 'gettyimages'
+    search_url = 'https://www.gettyimages.in/photos/'
+    img_xpath = "//figure[@class='gallery-mosaic-asset__figure']//img"
+    next_xpath = "//a[@class='search-pagination__button search-pagination__button--next']"
+    rate = (1, 2)
+
+
+@register
+class Picsearch(SiteAdapter):
+    name = 'picsearch'
+    search_url = 'https://www.picsearch.com/index.cgi?q='
+    img_xpath = "//span[@class='result']//img"
+    next_xpath = "//div//a[@id='nextPage']"
+    #Results are rendered server-side, so no browser is needed
+    requires_js = False
+    concurrency = 2
+
+
+@register
+class Bing(SiteAdapter):
+    name = 'bing'
+    search_url = 'https://www.bing.com/images/search?q='
+    img_xpath = "//div[@class='img_cont hoff']//img"
+    infinite_scroll = True
+
+    def next_page(self, page: 'WebPage', navigate: 'callable') -> bool:
+        page.driver.execute_script('window.scrollTo(0, document.body.scrollHeight);')
+        return True
@@ -0,0 +1,44 @@
+"""Browserless crawl engine for sites whose result pages are rendered server-side.
+Fetches pages over a pooled HttpClient and lets the site adapter read them with lxml
+"""
+
+#stdlib
+import logging
+from urllib.parse import urljoin
+#module
+from httpclient import HttpClient
+
+
+class StaticEngine:
+    """Walks result pages by following next-page links without a browser
+    """
+
+    def __init__(self, client: HttpClient=None, max_pages: int=4):
+        self.client = client or HttpClient()
+        self.max_pages = max_pages
+
+    @staticmethod
+    def parse(html: str, base_url: str, xpath: str, attr: str) -> list:
+        '''Returns the absolute attr URLs of every element matching an XPath'''
+        from lxml import html as lxml_html
+        tree = lxml_html.fromstring(html)
+        urls = []
+        for elem in tree.xpath(xpath):
+            value = elem.get(attr) if hasattr(elem, 'get') else str(elem)
+            if value:
+                urls.append(urljoin(base_url, value.strip()))
+        return urls
+
+    def crawl(self, site: 'SiteAdapter', url: str, start_page: int=0) -> 'generator':
+        '''Yields (page_index, image_urls, next_page_url) for up to the site's
+        max_pages result pages. next_page_url is None on the last page'''
+        for page in range(start_page, site.max_pages or self.max_pages):
+            resp = self.client.get(url)
+            if not resp.ok:
+                logging.warning('SE - %s returned %d', url, resp.status)
+                return
+            html = resp.text()
+            url = site.next_page_url(html, resp.url)
+            yield page, site.extract(html, resp.url), url
+            if not url:
+                return
@@ -0,0 +1,104 @@
+"""DriverPool against fake drivers, no browser needed
+"""
+
+#stdlib
+import threading
+#library
+import pytest
+#module
+from driverpool import DriverPool, NoDriversLeft
+from webpage import DriverFailure
+
+
+class FakeDriver:
+    def __init__(self):
+        self.closed = False
+
+    def close_page(self):
+        self.closed = True
+
+
+def test_runs_every_job_on_all_drivers():
+    seen, lock = {}, threading.Lock()
+
+    def worker(driver, job):
+        with lock:
+            seen[job] = driver
+
+    with DriverPool(FakeDriver, size=3) as pool:
+        pool.run([(i,) for i in range(30)], worker)
+        drivers = list(pool._all)
+    assert sorted(seen) == list(range(30))
+    assert set(seen.values()) <= set(drivers)
+    assert all(driver.closed for driver in drivers)
+
+
+def test_failed_driver_is_replaced_and_job_retried():
+    attempts = []
+
+    def worker(driver, job):
+        attempts.append(driver)
+        if len(attempts) == 1:
+            raise DriverFailure('browser went away')
+
+    done = []
+    with DriverPool(FakeDriver, size=1) as pool:
+        pool.run([('job',)], worker, on_done=done.append)
+    assert pool.replaced == 1
+    assert len(attempts) == 2 and attempts[0] is not attempts[1]
+    assert attempts[0].closed
+    assert done == [('job',)]
+
+
+def test_other_errors_drop_the_job_but_keep_the_driver():
+    drivers = []
+
+    def worker(driver, job):
+        drivers.append(driver)
+        raise ValueError('bad page')
+
+    with DriverPool(FakeDriver, size=1) as pool:
+        pool.run([(1,), (2,)], worker)
+    assert pool.replaced == 0
+    assert drivers[0] is drivers[1]
+
+
+def test_replacement_is_retried_with_backoff():
+    started = []
+
+    def factory():
+        started.append(1)
+        if len(started) in (2, 3):
+            raise OSError('chromedriver did not start')
+        return FakeDriver()
+
+    def worker(driver, job):
+        if job == 'fail':
+            raise DriverFailure('crashed')
+
+    with DriverPool(factory, size=1, backoff=0) as pool:
+        pool.run([('fail',), ('ok',)], worker)
+        assert pool.live == 1
+    assert len(started) == 5
+
+
+def test_run_fails_once_no_driver_can_be_started():
+    started = []
+
+    def factory():
+        started.append(1)
+        if len(started) > 1:
+            raise OSError('chromedriver did not start')
+        return FakeDriver()
+
+    def worker(driver, job):
+        raise DriverFailure('crashed')
+
+    done = []
+    with DriverPool(factory, size=1, restarts=2, backoff=0) as pool:
+        with pytest.raises(NoDriversLeft):
+            pool.run(((i,) for i in range(1000)), worker, on_done=done.append)
+    assert pool.live == 0
+    assert len(started) == 4
+    #Jobs already queued are handed back, the rest are never taken
+    assert 1 <= len(done) < 10
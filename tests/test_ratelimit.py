@@ -0,0 +1,95 @@
+"""HostRateLimiter and PolitenessScheduler on a fake clock
+"""
+
+#library
+import pytest
+#module
+from ratelimit import HostRateLimiter, PolitenessScheduler, TokenBucket, host_key
+
+
+class FakeClock:
+    """A clock that only moves when something sleeps on it
+    """
+
+    def __init__(self):
+        self.now = 0.
+        self.slept = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def limiter(**kwargs) -> tuple:
+    clock = FakeClock()
+    return HostRateLimiter(clock=clock, sleep=clock.sleep, **kwargs), clock
+
+
+def test_host_key():
+    assert host_key('https://WWW.Bing.com/images?q=a') == 'www.bing.com'
+    assert host_key('www.bing.com') == 'www.bing.com'
+
+
+def test_bucket_refills_up_to_burst():
+    bucket = TokenBucket(rate=2, burst=2, now=0)
+    assert bucket.reserve(0) == 0
+    assert bucket.reserve(0) == 0
+    assert bucket.reserve(0) == pytest.approx(.5)
+    assert bucket.delay(100) == 0
+    assert bucket.tokens == 2
+
+
+def test_burst_then_steady_rate():
+    limits, clock = limiter(rate=2, burst=4)
+    waits = [limits.acquire('https://cdn.example/a.jpg') for _ in range(8)]
+    assert waits[:4] == [0, 0, 0, 0]
+    assert waits[4:] == pytest.approx([.5] * 4)
+    #Eight requests with a burst of four at 2/s take two seconds
+    assert clock.now == pytest.approx(2)
+
+
+def test_hosts_are_limited_separately():
+    limits, clock = limiter(rate=1, burst=1)
+    assert limits.acquire('http://a.example/1') == 0
+    assert limits.acquire('http://b.example/1') == 0
+    assert limits.acquire('http://a.example/2') == pytest.approx(1)
+    assert clock.slept == [pytest.approx(1)]
+
+
+def test_per_host_limits_and_set_limit():
+    limits, clock = limiter(rate=10, burst=10, limits={'https://www.bing.com/': (1, 1)})
+    limits.acquire('https://www.bing.com/images')
+    assert limits.delay('https://www.bing.com/images') == pytest.approx(1)
+    assert limits.delay('https://cdn.example/x') == 0
+    limits.set_limit('www.bing.com', 100, 5)
+    assert limits.delay('https://www.bing.com/images') == 0
+
+
+def test_scheduler_interleaves_sites():
+    limits, _ = limiter(rate=1, burst=1)
+    jobs = PolitenessScheduler({'a': ('a.example', ['a1', 'a2', 'a3']),
+                                'b': ('b.example', ['b1', 'b2'])}, limits)
+    assert list(jobs) == ['a1', 'b1', 'a2', 'b2', 'a3']
+
+
+def test_scheduler_prefers_the_host_that_is_ready():
+    limits, clock = limiter(rate=1, burst=1)
+    limits.acquire('a.example')
+    jobs = PolitenessScheduler({'a': ('a.example', ['a1']), 'b': ('b.example', ['b1'])}, limits)
+    assert next(iter(jobs)) == 'b1'
+
+
+def test_scheduler_respects_concurrency():
+    limits, _ = limiter()
+    jobs = PolitenessScheduler({'a': ('a.example', ['a1', 'a2'], 1),
+                                'b': ('b.example', ['b1', 'b2'])}, limits)
+    taken = iter(jobs)
+    assert next(taken) == 'a1'
+    assert next(taken) == 'b1'
+    #a is still busy with a1, so b goes again
+    assert next(taken) == 'b2'
+    jobs.done('a')
+    assert next(taken) == 'a2'
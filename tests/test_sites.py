@@ -0,0 +1,131 @@
+"""Site adapters against saved result pages, offline. The fake WebPage answers
+extract() from the same HTML the way the browser script would
+"""
+
+#stdlib
+import os
+from urllib.parse import urljoin
+#library
+import pytest
+#module
+from sites import SITES, get_site
+
+lxml_html = pytest.importorskip('lxml.html')
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PAGE_URLS = {
+    'gettyimages': 'https://www.gettyimages.in/photos/hispanic-family?page=2',
+    'picsearch': 'https://www.picsearch.com/index.cgi?q=hispanic+family&start=21',
+    'bing': 'https://www.bing.com/images/search?q=hispanic+family',
+}
+IMAGES = {
+    'gettyimages': [
+        'https://media.gettyimages.com/photos/hispanic-family-picture-id1167381744?k=6&m=1167381744&s=612x612&w=0&h=5kGd6',
+        'https://media.gettyimages.com/photos/family-dinner-picture-id1203145523?k=6&m=1203145523&s=612x612&w=0&h=Jx0pQ',
+        'https://media.gettyimages.com/photos/grandmother-picture-id961259350?k=6&m=961259350&s=612x612&w=0&h=a81Rz',
+    ],
+    'picsearch': [
+        'https://thumbs.picsearch.com/thumb/8a2e91c4.jpg',
+        'https://thumbs.picsearch.com/thumb/51f07d3b.jpg',
+        'https://thumbs.picsearch.com/thumb/c0ffee42.jpg',
+    ],
+    'bing': [
+        'https://tse1.mm.bing.net/th?id=OIP.A1xQ&w=230&h=153&c=7&pid=1.7',
+        'https://tse2.mm.bing.net/th?id=OIP.B2yR&w=204&h=153&c=7&pid=1.7',
+        'https://tse3.mm.bing.net/th?id=OIP.C3zS&w=272&h=153&c=7&pid=1.7',
+    ],
+}
+NEXT_PAGES = {
+    'gettyimages': 'https://www.gettyimages.in/photos/hispanic-family?page=3&phrase=hispanic%20family',
+    'picsearch': 'https://www.picsearch.com/index.cgi?q=hispanic+family&start=41',
+    'bing': None,
+}
+
+
+def fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name + '.html'), encoding='utf-8') as src:
+        return src.read()
+
+
+class FakeDriver:
+    def __init__(self):
+        self.scripts = []
+
+    def execute_script(self, script: str, *args):
+        self.scripts.append(script)
+
+
+class FakePage:
+    """Stands in for a WebPage that has loaded html from url. Like the browser's
+    src and href properties, extract() returns absolute URLs
+    """
+
+    def __init__(self, html: str, url: str):
+        self.url = url
+        self.tree = lxml_html.fromstring(html)
+        self.driver = FakeDriver()
+
+    def extract(self, xpath: str, attrs: list=(), text: bool=False, start: int=0) -> list:
+        rows = []
+        for elem in self.tree.xpath(xpath)[start:]:
+            row = {}
+            for attr in attrs:
+                value = elem.get(attr)
+                row[attr] = urljoin(self.url, value) if value and attr in ('src', 'href') else value
+            if text:
+                row['text'] = elem.text_content()
+            rows.append(row)
+        return rows
+
+
+@pytest.mark.parametrize('name', sorted(PAGE_URLS))
+def test_extract(name):
+    assert get_site(name).extract(fixture(name), PAGE_URLS[name]) == IMAGES[name]
+
+
+@pytest.mark.parametrize('name', sorted(PAGE_URLS))
+def test_next_page_url(name):
+    assert get_site(name).next_page_url(fixture(name), PAGE_URLS[name]) == NEXT_PAGES[name]
+
+
+@pytest.mark.parametrize('name', sorted(PAGE_URLS))
+def test_extract_page(name):
+    page = FakePage(fixture(name), PAGE_URLS[name])
+    assert get_site(name).extract_page(page) == IMAGES[name]
+
+
+@pytest.mark.parametrize('name', ['gettyimages', 'picsearch'])
+def test_next_page_navigates_to_the_next_link(name):
+    visited = []
+    page = FakePage(fixture(name), PAGE_URLS[name])
+    assert get_site(name).next_page(page, lambda w, url: visited.append((w, url)))
+    assert visited == [(page, NEXT_PAGES[name])]
+
+
+@pytest.mark.parametrize('name', ['gettyimages', 'picsearch'])
+def test_next_page_stops_on_the_last_page(name):
+    visited = []
+    page = FakePage('<html><body><p>No more results</p></body></html>', PAGE_URLS[name])
+    assert not get_site(name).next_page(page, lambda w, url: visited.append(url))
+    assert visited == []
+    assert get_site(name).next_page_url('<html><body></body></html>', PAGE_URLS[name]) is None
+
+
+def test_bing_next_page_scrolls_instead_of_navigating():
+    visited = []
+    page = FakePage(fixture('bing'), PAGE_URLS['bing'])
+    assert get_site('bing').next_page(page, lambda w, url: visited.append(url))
+    assert visited == []
+    assert page.driver.scripts == ['window.scrollTo(0, document.body.scrollHeight);']
+
+
+def test_registry():
+    assert set(PAGE_URLS) <= set(SITES)
+    assert not SITES['picsearch'].requires_js
+    assert SITES['bing'].infinite_scroll
+    #Browser sites are bound by the driver pool alone
+    assert SITES['bing'].concurrency is None and SITES['gettyimages'].concurrency is None
+    assert SITES['gettyimages'].search_url_for('hispanic+family') == \
+        'https://www.gettyimages.in/photos/hispanic+family'
+    with pytest.raises(KeyError):
+        get_site('altavista')
@@ -0,0 +1,58 @@
+"""StaticEngine against the local fake search server, no network or browser
+"""
+
+#library
+import pytest
+#module
+from fakesearch import FakeSearchServer
+from httpclient import HttpClient
+from staticengine import StaticEngine
+
+pytest.importorskip('lxml')
+
+
+@pytest.fixture
+def server():
+    with FakeSearchServer(pages=3, per_page=5) as server:
+        yield server
+
+
+def test_parse_makes_urls_absolute():
+    html = "<html><body><span class='result'><img src='/a.jpg'></span><img src='b.jpg'></body></html>"
+    assert StaticEngine.parse(html, 'http://x.example/p/q', "//span[@class='result']//img", 'src') == [
+        'http://x.example/a.jpg']
+
+
+def test_crawl_follows_next_page_links(server):
+    site = server.sites()['picsearch']
+    with HttpClient() as client:
+        pages = list(StaticEngine(client).crawl(site, site.search_url_for('red+car')))
+    assert [page for page, _, _ in pages] == [0, 1, 2]
+    assert all(len(urls) == 5 for _, urls, _ in pages)
+    assert pages[0][1][0] == server.url + '/img/picsearch/red%20car/0.png'
+    assert pages[2][1][-1] == server.url + '/img/picsearch/red%20car/14.png'
+    assert pages[0][2] == server.url + '/index.cgi?q=red%20car&start=1'
+    assert pages[-1][2] is None
+
+
+def test_crawl_resumes_from_a_page(server):
+    site = server.sites()['picsearch']
+    with HttpClient() as client:
+        pages = list(StaticEngine(client).crawl(site, server.url + '/index.cgi?q=cat&start=2', 2))
+    assert [page for page, _, _ in pages] == [2]
+    assert pages[0][1][0].endswith('/img/picsearch/cat/10.png')
+
+
+def test_crawl_stops_at_max_pages(server):
+    site = server.sites()['gettyimages']
+    site.max_pages = 2
+    with HttpClient() as client:
+        pages = list(StaticEngine(client).crawl(site, site.search_url_for('dog')))
+    assert len(pages) == 2
+    assert pages[-1][2] == server.url + '/photos/dog?page=2'
+
+
+def test_crawl_stops_on_an_error_page(server):
+    site = server.sites()['picsearch']
+    with HttpClient() as client:
+        assert list(StaticEngine(client).crawl(site, server.url + '/missing')) == []
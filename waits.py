@@ -0,0 +1,94 @@
+"""Condition-based waits for WebDriverWait that replace fixed sleeps.
+Each condition is a callable taking the driver and returning a truthy value once met.
+Element presence and staleness use Selenium's own expected_conditions
+"""
+
+#stdlib
+from time import monotonic
+
+COUNT_JS = '''return document.evaluate(arguments[0], document, null,
+    XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null).snapshotLength;'''
+
+#Ready state plus the number of resources the page has requested so far
+NETWORK_JS = '''return [document.readyState,
+    window.performance ? performance.getEntriesByType('resource').length : 0];'''
+
+
+class _Settled:
+    """Base for conditions that are met once a sampled value stops changing"""
+
+    def __init__(self, settle: float=.5, clock: 'callable'=monotonic):
+        self.settle = settle
+        self.clock = clock
+        self._last = None
+        self._since = None
+
+    def sample(self, driver):
+        raise NotImplementedError
+
+    def ready(self, value) -> bool:
+        return True
+
+    def __call__(self, driver):
+        value = self.sample(driver)
+        now = self.clock()
+        if value != self._last:
+            self._last, self._since = value, now
+            return False
+        if self.ready(value) and now - self._since >= self.settle:
+            return value or True
+        return False
+
+
+class result_count_stable(_Settled):
+    """Met when at least minimum elements match an XPath and the count has not
+    grown for settle seconds. Returns the count
+    """
+
+    def __init__(self, xpath: str, minimum: int=1, settle: float=.5, clock: 'callable'=monotonic):
+        super().__init__(settle, clock)
+        self.xpath = xpath
+        self.minimum = minimum
+
+    def sample(self, driver) -> int:
+        return driver.execute_script(COUNT_JS, self.xpath)
+
+    def ready(self, value: int) -> bool:
+        return value >= self.minimum
+
+
+class result_count_above:
+    """Met as soon as more than count elements match an XPath. Returns the new count
+    """
+
+    def __init__(self, xpath: str, count: int):
+        self.xpath = xpath
+        self.count = count
+
+    def __call__(self, driver):
+        value = driver.execute_script(COUNT_JS, self.xpath)
+        return value if value > self.count else False
+
+
+class network_idle(_Settled):
+    """Met once the document is complete and no new resources were requested
+    for settle seconds
+    """
+
+    def sample(self, driver) -> tuple:
+        return tuple(driver.execute_script(NETWORK_JS))
+
+    def ready(self, value: tuple) -> bool:
+        return value[0] == 'complete'
+
+
+class focused:
+    """Met once an element has keyboard focus
+    """
+
+    def __init__(self, element):
+        self.element = element
+
+    def __call__(self, driver) -> bool:
+        return driver.execute_script('return document.activeElement === arguments[0];',
+                                     self.element)
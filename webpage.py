@@ -8,7 +8,8 @@ Uses Selenium to interact/crawl a given web page
 # pylint: disable=W0702
 
 #stdlib
-import logging, json
+import logging, json, os
+from importlib import import_module
 from os import path, R_OK, access
 from shutil import rmtree
 from contextlib import contextmanager
@@ -16,21 +17,53 @@ from time import sleep
 from random import randint
 import tempfile
 from copy import deepcopy
-#library
-from pkg_resources import resource_filename
-from selenium import webdriver
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
-from selenium.webdriver.firefox.firefox_binary import FirefoxBinary
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait, Select
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.support.expected_conditions import \
-    staleness_of, presence_of_element_located, alert_is_present
-from user_agent import generate_user_agent
 import socket
 #module
+from waits import network_idle, focused
+
+
+class _Lazy:
+    """Stands in for a module, or a name in one, and imports it on first use.
+    Keeps importing this module cheap; selenium alone pulls in dozens of submodules
+    """
+
+    def __init__(self, module: str, name: str=None):
+        self._module = module
+        self._name = name
+        self._target = None
+
+    def _load(self):
+        if self._target is None:
+            target = import_module(self._module)
+            self._target = getattr(target, self._name) if self._name else target
+        return self._target
+
+    def __getattr__(self, attr: str):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+
+#library, imported when first used
+resource_filename = _Lazy('pkg_resources', 'resource_filename')
+webdriver = _Lazy('selenium.webdriver')
+By = _Lazy('selenium.webdriver.common.by', 'By')
+DesiredCapabilities = _Lazy('selenium.webdriver.common.desired_capabilities', 'DesiredCapabilities')
+FirefoxBinary = _Lazy('selenium.webdriver.firefox.firefox_binary', 'FirefoxBinary')
+Options = _Lazy('selenium.webdriver.chrome.options', 'Options')
+WebDriverWait = _Lazy('selenium.webdriver.support.ui', 'WebDriverWait')
+Select = _Lazy('selenium.webdriver.support.ui', 'Select')
+ActionChains = _Lazy('selenium.webdriver.common.action_chains', 'ActionChains')
+staleness_of = _Lazy('selenium.webdriver.support.expected_conditions', 'staleness_of')
+presence_of_element_located = _Lazy('selenium.webdriver.support.expected_conditions',
+                                     'presence_of_element_located')
+alert_is_present = _Lazy('selenium.webdriver.support.expected_conditions', 'alert_is_present')
+element_to_be_clickable = _Lazy('selenium.webdriver.support.expected_conditions',
+                                'element_to_be_clickable')
+generate_user_agent = _Lazy('user_agent', 'generate_user_agent')
 
 
 #Firefox normal and download preferences
@@ -71,6 +104,85 @@ FF_DOWNLOAD_PREFS = {
     'browser.download.panel.shown': False
 }
 
+#Lean mode: headless (Firefox 56+), no image decoding, stylesheets, fonts or media and a small cache.
+#The crawler only reads src attributes so none of that has to be rendered
+FF_LEAN_PREFS = {
+    'permissions.default.image': 2,
+    'permissions.default.stylesheet': 2,
+    'browser.display.use_document_fonts': 0,
+    'gfx.downloadable_fonts.enabled': False,
+    'media.autoplay.default': 5,
+    'media.autoplay.enabled': False,
+    'media.play-stand-alone': False,
+    'browser.cache.memory.capacity': 16384,
+    'browser.sessionhistory.max_entries': 2,
+    'browser.migration.version': 9999
+}
+CHROME_LEAN_SWITCHES = ['--headless','--disable-gpu','--window-size=1366,900',
+    '--blink-settings=imagesEnabled=false','--disk-cache-size=16777216',
+    '--media-cache-size=1','--mute-audio','--disable-extensions',
+    '--disable-background-networking','--disable-dev-shm-usage','--autoplay-policy=user-required']
+CHROME_LEAN_PREFS = {
+    'profile.managed_default_content_settings.images': 2
+}
+#Chrome has no content setting for stylesheets, fonts or media playback, so lean
+#sessions block those requests through the DevTools protocol instead
+CHROME_LEAN_BLOCKED = [pattern.format(ext) for ext in ('css', 'woff', 'woff2', 'ttf', 'otf', 'eot',
+                                                       'mp4', 'webm', 'ogg', 'ogv', 'mp3', 'm4a',
+                                                       'm3u8', 'ts')
+                       for pattern in ('*.{}', '*.{}?*')]
+#Firefox only runs headless from version 56; older builds get the lean prefs in a window
+FF_HEADLESS_VERSION = 56
+
+#Evaluates an XPath and reads attributes/text for every match in one round-trip
+#Properties are preferred over attributes to match WebElement.get_attribute
+EXTRACT_JS = '''
+var snap = document.evaluate(arguments[0], document, null,
+    XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+var attrs = arguments[1], rows = [];
+for (var i = arguments[3] || 0; i < snap.snapshotLength; i++) {
+    var el = snap.snapshotItem(i), row = {};
+    for (var j = 0; j < attrs.length; j++) {
+        var val = el[attrs[j]];
+        if (val === undefined || val === null || typeof val === 'object') {
+            val = el.getAttribute ? el.getAttribute(attrs[j]) : null;
+        }
+        row[attrs[j]] = val === null || val === undefined ? null : String(val);
+    }
+    if (arguments[2]) {
+        row.text = el.innerText === undefined ? el.textContent : el.innerText;
+    }
+    rows.push(row);
+}
+return rows;
+'''
+
+#Server used to read a sticky-IP response header through a proxy when the proxy
+#dict has no check_url of its own; PROXY_CHECK_URL in the environment overrides it
+PROXY_CHECK_URL = os.environ.get('PROXY_CHECK_URL', 'http://54.91.52.231/')
+
+def attach_driver(remote: dict) -> 'webdriver.Remote':
+    '''Returns a Remote driver bound to an already running session, described by
+    remote's executor, session_id, capabilities and w3c, instead of starting one'''
+
+    class AttachedDriver(webdriver.Remote):
+        def start_session(self, *_, **__):
+            self.session_id = remote['session_id']
+            self.capabilities = remote.get('capabilities') or {}
+            self.w3c = remote.get('w3c', True)
+    return AttachedDriver(command_executor=remote['executor'], desired_capabilities={})
+
+
+def firefox_version(location: str) -> int:
+    '''Returns the major version of a Firefox binary, or 0 if it cannot be read'''
+    from subprocess import check_output
+    try:
+        out = check_output([location, '--version'], timeout=30).decode('utf-8', 'replace')
+        return int(out.strip().rsplit(' ', 1)[-1].split('.')[0])
+    except Exception:
+        return 0
+
+
 class DriverFailure(Exception):
     """Custom exception thrown when the browser connection fails
     """
@@ -86,18 +198,49 @@ class WebPage:
 
     def __init__(self, url: str, browser: str='firefox',
                     proxy: dict=None, uses_recaptcha: bool=False,download_document: bool=False,
-                    load_images: bool=True):
+                    load_images: bool=True, wait_timeout: float=10, wait_poll: float=.1,
+                    lean: bool=False, profile_dir: str=None, capture_network: bool=False,
+                    remote: dict=None):
         """Init a Selenium driver. Must be given a URL.
         Specify the type of browser and version to use (Firefox, PhantomJS)
+        wait_timeout and wait_poll are the defaults used by wait()
+        lean starts Chrome headless without images, CSS, fonts or media; CSS, fonts
+        and media are blocked by URL pattern, so ones served without a file
+        extension still load. Firefox gets the same prefs but only runs headless
+        from version 56, so the bundled Firefox 46 keeps its window
+        profile_dir reuses (and keeps) a Chrome profile instead of a temp one. Firefox
+        only takes it as a template: the profile is copied to a temp one that
+        close_page() removes, so nothing carries over between Firefox sessions
+        capture_network (Chrome only) records network events for network_images();
+        images are then left enabled in lean mode so that they are requested
+        round_trips counts the commands sent to the driver since it started
+        remote attaches to a session leased from a browser daemon (see browserd.py)
+        instead of launching a browser; close_page() then leaves the session running
         """
         browser = browser.lower()
+        self.wait_timeout = wait_timeout
+        self.wait_poll = wait_poll
         self.download_dir = tempfile.TemporaryDirectory()
         self.url = url
         self.browser = browser
-        if browser.startswith('firefox'):
-            #Generate Firefox Profile from desired preferences
-            self.profile = webdriver.FirefoxProfile()
+        self.proxy = proxy
+        self.lean = lean
+        self.capture_network = capture_network
+        self.remote = remote
+        if capture_network and browser != 'chrome':
+            raise DriverFailure('Network capture needs the chrome browser')
+        if remote is not None:
+            try:
+                self.driver = attach_driver(remote)
+            except Exception as e:
+                raise DriverFailure('Could not attach to session {}: {}'.format(remote.get('session_id'), e))
+        elif browser.startswith('firefox'):
+            #Generate Firefox Profile from desired preferences. FirefoxProfile copies
+            #profile_dir, and the legacy driver has to load its extension into that copy
+            self.profile = webdriver.FirefoxProfile(profile_dir)
             prefs = deepcopy(FF_PREFS)
+            if lean:
+                prefs.update(FF_LEAN_PREFS)
             if not load_images:
                 prefs['permissions.default.image'] = 2
                 prefs['browser.migration.version'] = 9999
@@ -128,6 +271,8 @@ class WebPage:
                 while not access(location,R_OK):
                     sleep(1)
                 binary = FirefoxBinary(location)
+                if lean and firefox_version(location) >= FF_HEADLESS_VERSION:
+                    binary.add_command_line_options('-headless')
                 self.driver = webdriver.Firefox(
                     self.profile,
                     firefox_binary=binary,
@@ -143,17 +288,27 @@ class WebPage:
                 raise DriverFailure('An error occured initializing the Firefox browser')
         elif browser == 'chrome':
             proxy_details = user_agent = None
-            PROXY='221.126.249.102:8080'
-            self.chrome_profile = tempfile.TemporaryDirectory()
+            if profile_dir:
+                self.chrome_profile_dir = profile_dir
+            else:
+                self.chrome_profile = tempfile.TemporaryDirectory()
+                self.chrome_profile_dir = self.chrome_profile.name
             chrome_options = webdriver.ChromeOptions()
-            chrome_options.add_argument('--proxy-server=%s' % PROXY)
-            driver=webdriver.Chrome('/usr/lib/chromium-browser/chromedriver',chrome_options=chrome_options)
-            profile_dir = '--user-data-dir='+self.chrome_profile.name
             chrome_switches = ['--allow-outdated-plugins','--allow-running-insecure-content',
             '--crash-on-hang-threads=UI:60,IO:60','--deny-permission-prompts','--disable-component-update',
             '--disable-popup-blocking','--no-default-browser-check','--ignore-ssl-errors',
-            '--ignore-certificate-errors',profile_dir,'--no-first-run','--start-maximized',
+            '--ignore-certificate-errors','--user-data-dir='+self.chrome_profile_dir,'--no-first-run',
             '--no-sandbox']
+            if lean:
+                lean_prefs = dict(CHROME_LEAN_PREFS)
+                lean_switches = list(CHROME_LEAN_SWITCHES)
+                if capture_network:
+                    del lean_prefs['profile.managed_default_content_settings.images']
+                    lean_switches.remove('--blink-settings=imagesEnabled=false')
+                chrome_switches.extend(lean_switches)
+                chrome_options.add_experimental_option('prefs', lean_prefs)
+            else:
+                chrome_switches.append('--start-maximized')
             if not uses_recaptcha:
                 user_agent = '--user-agent='+generate_user_agent(device_type=['desktop'])
             if user_agent:
@@ -180,7 +335,13 @@ class WebPage:
                 chrome_switches.append(proxy_details)
             for chrswt in chrome_switches:
                 chrome_options.add_argument(chrswt)
-            self.driver = webdriver.Chrome(executable_path="/usr/lib/chromium-browser/chromedriver",chrome_options=chrome_options)
+            caps = DesiredCapabilities.CHROME.copy()
+            if capture_network:
+                caps['loggingPrefs'] = caps['goog:loggingPrefs'] = {'performance': 'ALL'}
+            self.driver = webdriver.Chrome(executable_path="/usr/lib/chromium-browser/chromedriver",
+                                           chrome_options=chrome_options, desired_capabilities=caps)
+            if lean:
+                self.__block_urls(CHROME_LEAN_BLOCKED)
             if proxy and 'ip' in proxy and '@' in proxy['ip']:
                 self.configure_proxy(credentials['user'],credentials['pass'])
         elif browser == 'phantomjs':
@@ -194,6 +355,8 @@ class WebPage:
                 raise DriverFailure('An error occured initializing the PhantomJS driver')
         else:
             raise DriverFailure('"{}" is not a valid browser option'.format(browser))
+        self.round_trips = 0
+        self.__count_round_trips()
 
     #These two allow the WebPage to be used in a "with" clause
     def __enter__(self):
@@ -201,18 +364,71 @@ class WebPage:
     def __exit__(self, *_):
         self.close_page()
 
+    def __count_round_trips(self):
+        '''Counts every command sent to the driver in self.round_trips'''
+        execute = self.driver.execute
+        def counted(*args, **kwargs):
+            self.round_trips += 1
+            return execute(*args, **kwargs)
+        self.driver.execute = counted
+
     @staticmethod
     def delay(msec: int):
         '''Wait a given number of milliseconds'''
         sleep(msec / 1000)
 
+    def network_images(self) -> list:
+        '''Returns the image responses seen since the last call as dicts of
+        url, status, mime_type and length (Content-Length, or None)'''
+        images = []
+        for entry in self.driver.get_log('performance'):
+            try:
+                message = json.loads(entry['message'])['message']
+            except (KeyError, ValueError):
+                continue
+            if message.get('method') != 'Network.responseReceived':
+                continue
+            params = message.get('params', {})
+            resp = params.get('response', {})
+            mime_type = resp.get('mimeType', '')
+            if params.get('type') != 'Image' and not mime_type.startswith('image/'):
+                continue
+            if not resp.get('url', '').startswith('http'):
+                continue
+            headers = {k.lower(): v for k, v in resp.get('headers', {}).items()}
+            length = headers.get('content-length')
+            images.append({'url': resp['url'], 'status': resp.get('status'),
+                           'mime_type': mime_type,
+                           'length': int(length) if length and length.isdigit() else None})
+        return images
+
+    def wait(self, condition: 'callable', timeout: float=None, poll: float=None):
+        '''Polls a condition until it returns a truthy value, which is returned.
+        Returns None if the timeout expires first'''
+        from selenium.common.exceptions import TimeoutException
+        try:
+            return WebDriverWait(self.driver, timeout or self.wait_timeout,
+                                 poll_frequency=poll or self.wait_poll).until(condition)
+        except TimeoutException:
+            return None
+
+    def __block_urls(self, patterns: list):
+        """Makes Chrome fail requests matching any of the URL patterns (* wildcards)"""
+        try:
+            self.driver.execute_cdp_cmd('Network.enable', {})
+            self.driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+        except Exception as e:
+            logging.warning('WP - Could not block lean mode requests: %s', e)
+
     @staticmethod
-    def get_proxy_resp_header(url: str, port: int, header: str) -> str:
-        """Makes a simple request through a proxy and returns the value of a response header"""
+    def get_proxy_resp_header(url: str, port: int, header: str,
+                                check_url: str=None, timeout: float=30) -> str:
+        """Makes a simple request through a proxy and returns the value of a response header.
+        check_url defaults to PROXY_CHECK_URL"""
         from requests import get
         proxy = 'http://{}:{}'.format(url, port)
         proxies = {'http': proxy}
-        resp = get('http://54.91.52.231/', proxies=proxies)
+        resp = get(check_url or PROXY_CHECK_URL, proxies=proxies, timeout=timeout)
         header_val = resp.headers[header]
         print(header_val)
         return header_val
@@ -229,14 +445,14 @@ class WebPage:
 
     def __configure_proxy_prefs(self, proxy: dict) -> dict:
         """Returns a dict of profile preferences from a dict of proxy settings
-        proxy keys: url, port (, response_header)
+        proxy keys: ip, port (, is_socks5, sticky_ip_header, check_url)
         """
         proxy_url, proxy_port = proxy['ip'], proxy['port']
         proxy_prefs = FF_PROXY_PREFS
         #Add custom response header if available
         if 'sticky_ip_header' in proxy and proxy['sticky_ip_header']:
             header = proxy['sticky_ip_header']
-            value = self.get_proxy_resp_header(proxy_url, proxy_port, header)
+            value = self.get_proxy_resp_header(proxy_url, proxy_port, header, proxy.get('check_url'))
             proxy_prefs["modifyheaders.headers.count"] = 1
             proxy_prefs["modifyheaders.headers.action0"] = "Add"
             proxy_prefs["modifyheaders.headers.name0"] = header
@@ -276,22 +492,20 @@ class WebPage:
         if url:
             self.url = url
         self.driver.get(self.url)
-        #This waits for 5 seconds and handles alert popups
+        #Wait for the page to stop requesting resources, then handle alert popups
         try:
+            self.wait(network_idle())
             if self.browser != 'phantomjs':
-                WebDriverWait(self.driver, 5).until(alert_is_present())
-                alert = self.driver.switch_to_alert()
-                alert.accept()
-            sleep(5)
+                self.accept_alerts()
         except Exception as e:
             print(e)
 
     def accept_alerts(self):
         try:
-            if alert_is_present():
-                alert = self.driver.switch_to_alert()
+            alert = alert_is_present()(self.driver)
+            if alert:
                 alert.accept()
-                sleep(1)
+                self.wait(network_idle())
         except Exception as e:
             print(e)
 
@@ -303,7 +517,9 @@ class WebPage:
         '''Close the page/driver'''
         try:
             self.download_dir.cleanup()
-            self.driver.quit()
+            #An attached session belongs to the daemon, which resets and reuses it
+            if self.remote is None:
+                self.driver.quit()
         except:
             pass
         #Remove the profile if it exists
@@ -387,16 +603,22 @@ class WebPage:
                 logging.warning('WP - Attribute not found')
             return ''
 
+    def extract(self, xpath: str, attrs: 'list'=(), text: bool=False, start: int=0) -> list:
+        '''Returns a dict of the given attributes (and "text") for every element
+        matching an XPath using a single execute_script call.
+        Matches before index start are skipped'''
+        return self.driver.execute_script(EXTRACT_JS, xpath, list(attrs), text, start) or []
+
+    @staticmethod
+    def _row_text(row: dict) -> str:
+        if row.get('text'):
+            return row['text'].strip()
+        return row.get('value')
+
     def get_text(self, xpath: str) -> str:
         '''Returns the text for one or more elements at a given XPath'''
         try:
-            text = []
-            elements = self.driver.find_elements_by_xpath(xpath)
-            for item in elements:
-                if item.text:
-                    text.append(item.text.strip())
-                else:
-                    text.append(item.get_attribute('value'))
+            text = [self._row_text(row) for row in self.extract(xpath, ['value'], text=True)]
             return '|'.join(set(text))
         except:
             logging.warning('WP - Text not found')
@@ -405,16 +627,8 @@ class WebPage:
     def list_text(self, xpath: str) -> str:
         '''Returns the text for one or more elements at a given XPath'''
         try:
-            text = []
             data = []
-            elements = self.driver.find_elements_by_xpath(xpath)
-            #print(elements)
-            for item in elements:
-                if item.text:
-                    text.append(item.text.strip())
-                else:
-                    text.append(item.get_attribute('value'))
-            #print(text)
+            text = [self._row_text(row) for row in self.extract(xpath, ['value'], text=True)]
             for word in list(text):
                 if word is None:
                     data.append("")
@@ -433,7 +647,7 @@ class WebPage:
             text_field = self.driver.find_element_by_xpath(xpath)
             if text_field:
                 ActionChains(self.driver).move_to_element(text_field).click(text_field).perform()
-                sleep(1)
+                self.wait(focused(text_field))
                 text_field.clear()
                 text_field.send_keys(text)
                 self.driver.find_element_by_xpath('/html//body').click()
@@ -476,12 +690,12 @@ class WebPage:
                     if new_window:
                         with self.wait_for_window():
                             ActionChains(self.driver).move_to_element(button).perform()
-                            sleep(.5)
+                            self.wait(element_to_be_clickable((By.XPATH, xpath)))
                             button.click()
                     else:
                         with self.wait_for_load():
                             ActionChains(self.driver).move_to_element(button).perform()
-                            sleep(.5)
+                            self.wait(element_to_be_clickable((By.XPATH, xpath)))
                             button.click()
                 else:
                     ActionChains(self.driver).move_to_element(button).perform()
@@ -489,7 +703,6 @@ class WebPage:
                 #Always make sure that the most recent window is active
                 self.driver.switch_to_window(self.driver.window_handles[-1])
                 self.accept_alerts()
-                sleep(.01)
                 return True
             return False
         except:
@@ -505,7 +718,7 @@ class WebPage:
             link = self.driver.find_element_by_xpath(xpath)
             self.driver.execute_script("arguments[0].scrollIntoView();",link)
             ActionChains(self.driver).move_to_element(link).perform()
-            sleep(.5)
+            self.wait(element_to_be_clickable((By.XPATH, xpath)))
             link.click()
             self.accept_alerts()
             return True
@@ -519,11 +732,10 @@ class WebPage:
         try:
             select = self.driver.find_element_by_xpath(xpath)
             ActionChains(self.driver).move_to_element(select).perform()
-            sleep(.5)
+            self.wait(element_to_be_clickable((By.XPATH, xpath)))
             select.click()
-            sleep(.1)
+            self.wait(focused(select))
             select.send_keys(text)
-            sleep(.1)
             self.driver.find_element_by_xpath('/html//body').click()
             return True
             # select = Select(self.driver.find_element_by_xpath(xpath))